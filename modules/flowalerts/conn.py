@@ -1,13 +1,23 @@
+import bisect
 import contextlib
+import functools
 import ipaddress
 import json
+import re
 import sys
 from datetime import datetime
-from typing import Tuple, List, Dict
-import validators
+from typing import (
+    Tuple,
+    List,
+    Dict,
+    Optional,
+    Union,
+    Set,
+    Iterable,
+)
 
 from modules.flowalerts.dns import DNS
-from modules.flowalerts.timer_thread import TimerThread
+from modules.flowalerts.timer_thread import TimerScheduler
 from slips_files.common.abstracts.flowalerts_analyzer import (
     IFlowalertsAnalyzer,
 )
@@ -15,18 +25,156 @@ from slips_files.common.parsers.config_parser import ConfigParser
 from slips_files.common.slips_utils import utils
 
 
+# an ipv4 in the dotted decimal form that ipaddress accepts. \d isn't
+# used because it matches non-ascii digits too
+IPV4_OCTET = r"(25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[1-9]?[0-9])"
+IPV4_REGEX = re.compile(rf"{IPV4_OCTET}(\.{IPV4_OCTET}){{3}}")
+
+
+def is_ipv4(ip: Optional[str]) -> bool:
+    """
+    cheaper than validators.ipv4() for checking the ips of every flow
+    """
+    return bool(ip and IPV4_REGEX.fullmatch(ip))
+
+
+@functools.lru_cache(maxsize=8192)
+def get_ip_obj(
+    ip: str,
+) -> Union[ipaddress.IPv4Address, ipaddress.IPv6Address]:
+    """
+    returns the parsed ipaddress obj of the given ip.
+    flows repeat the same ips a lot, so this saves us from re-parsing the
+    same ip str once per detection
+    """
+    return ipaddress.ip_address(ip)
+
+
+@functools.lru_cache(maxsize=8192)
+def is_private_ip(
+    ip_obj: Union[ipaddress.IPv4Address, ipaddress.IPv6Address],
+) -> bool:
+    """
+    cached utils.is_private_ip(), ip_obj.is_private goes through
+    all the private networks every time
+    """
+    return utils.is_private_ip(ip_obj)
+
+
+def is_multicast(
+    ip_obj: Union[ipaddress.IPv4Address, ipaddress.IPv6Address],
+) -> bool:
+    """
+    same as ip_obj.is_multicast, but uses a plain int comparison for ipv4
+    """
+    if ip_obj.version == 4:
+        # 224.0.0.0/4
+        return int(ip_obj) >> 28 == 0xE
+    return ip_obj.is_multicast
+
+
+def is_multicast_link_local_or_reserved(
+    ip_obj: Union[ipaddress.IPv4Address, ipaddress.IPv6Address],
+) -> bool:
+    """
+    same as checking ip_obj.is_multicast, ip_obj.is_link_local and
+    ip_obj.is_reserved, but uses plain int comparisons for ipv4
+    """
+    if ip_obj.version == 4:
+        ip_int = int(ip_obj)
+        # 224.0.0.0/4 is multicast, 240.0.0.0/4 is reserved,
+        # 169.254.0.0/16 is link local
+        return ip_int >> 28 >= 0xE or ip_int >> 16 == 0xA9FE
+    return ip_obj.is_multicast or ip_obj.is_link_local or ip_obj.is_reserved
+
+
+# app protocols that don't need a dns resolution before the connection
+IGNORED_APPPROTOS_FOR_CONN_WITHOUT_DNS = frozenset(("dns", "icmp"))
+# max number of (ip, org) results to keep in Conn.ip_in_org_cache
+IP_IN_ORG_CACHE_SIZE = 65536
+# protocols that have no ports, so port 0 means nothing for them
+PROTOS_WITHOUT_PORTS = frozenset(("igmp", "icmp", "ipv6-icmp", "arp"))
+
+
+def port_to_int(port: Union[int, str, None]) -> Union[int, str, None]:
+    """
+    returns the given port as an int.
+    ports that aren't numbers, e.g. "" in arp flows or the hex
+    icmp types of argus, are returned as they are
+    """
+    try:
+        return int(port)
+    except (ValueError, TypeError):
+        return port
+
+
+def build_ip_ranges(
+    networks: Iterable[str],
+) -> Dict[int, Tuple[List[int], List[int]]]:
+    """
+    converts the given networks to sorted non-overlapping int ranges per
+    ip version, so that they can be searched using bisect.
+    invalid networks are skipped.
+    returns {ip_version: ([range_starts], [range_ends])}
+    """
+    ranges: Dict[int, List[Tuple[int, int]]] = {4: [], 6: []}
+    for network in networks:
+        with contextlib.suppress(ValueError):
+            net = ipaddress.ip_network(network)
+            ranges[net.version].append(
+                (int(net.network_address), int(net.broadcast_address))
+            )
+
+    ip_ranges = {}
+    for version, version_ranges in ranges.items():
+        starts, ends = [], []
+        for start, end in sorted(version_ranges):
+            if ends and start <= ends[-1] + 1:
+                # overlaps or touches the previous range, merge them
+                ends[-1] = max(ends[-1], end)
+                continue
+            starts.append(start)
+            ends.append(end)
+        ip_ranges[version] = (starts, ends)
+    return ip_ranges
+
+
+def is_ip_in_ranges(
+    ip_obj: Union[ipaddress.IPv4Address, ipaddress.IPv6Address],
+    ip_ranges: Dict[int, Tuple[List[int], List[int]]],
+) -> bool:
+    """checks if the given ip belongs to the output of build_ip_ranges()"""
+    starts, ends = ip_ranges[ip_obj.version]
+    ip_int = int(ip_obj)
+    # the index of the last range starting at or before this ip
+    idx = bisect.bisect_right(starts, ip_int) - 1
+    return idx >= 0 and ip_int <= ends[idx]
+
+
 class Conn(IFlowalertsAnalyzer):
     def init(self):
         # get the default gateway
         self.gateway = self.db.get_gateway_ip()
         self.p2p_daddrs = {}
+        # reconnection attempts of each open profile_tw, read from the db
+        # once and kept here until the tw is closed.
+        # {profileid_twid: {"saddr-daddr-dport": [count, [uids]]}}
+        self.reconnections: Dict[str, Dict[str, List]] = {}
+        # profile_tws whose reconnections changed since the last db write
+        self.unsaved_reconnections: Set[str] = set()
+        # bytes sent to each ip in each open profile_tw
+        # {profileid_twid: {daddr: [total bytes, [uids], last ts]}}
+        self.bytes_sent: Dict[str, Dict[str, list]] = {}
         # If 1 flow uploaded this amount of MBs or more,
         # slips will alert data upload
         self.flow_upload_threshold = 100
         self.read_configuration()
-        # Cache list of connections that we already checked in the timer
+        # Cache of connections that we already checked in the timer
         # thread (we waited for the dns resolution for these connections)
-        self.connections_checked_in_conn_dns_timer_thread = []
+        self.connections_checked_in_conn_dns_timer_thread: Set[str] = set()
+        # one thread that re-checks all the conns waiting for their
+        # dns resolution instead of one thread per conn
+        self.conn_without_dns_timer = TimerScheduler(self.flowalerts.print)
         self.whitelist = self.flowalerts.whitelist
         # Threshold how much time to wait when capturing in an interface,
         # to start reporting connections without DNS
@@ -34,6 +182,45 @@ class Conn(IFlowalertsAnalyzer):
         # In mins
         self.conn_without_dns_interface_wait_time = 30
         self.dns_analyzer = DNS(self.db, flowalerts=self)
+        # (network address, netmask) of our local network as ints.
+        # set on the first use because the local network isn't
+        # in the db yet when this analyzer starts
+        self.localnet: Optional[Tuple[int, int]] = None
+        # cache of the ip ranges of the orgs known to use a port
+        # {portproto: {ip_version: ([range_starts], [range_ends])}}
+        self.org_ranges: Dict[str, dict] = {}
+        # these are set in the db before the modules start and don't
+        # change during the run, so there's no need to ask redis about
+        # them once per flow
+        self.input_type: str = self.db.get_input_type()
+        self.slips_start_time = self.db.get_slips_start_time()
+        self.is_running_non_stop: bool = (
+            "-i" in sys.argv or self.db.is_growing_zeek_dir()
+        )
+        # ips that we know belong to a well-known org.
+        # only positive results are cached because the SNI and rDNS of an
+        # ip may arrive after we check it
+        self.well_known_org_ips: Set[str] = set()
+        # ips that we know are DoH servers
+        self.doh_servers: Set[str] = set()
+        # the ASNs, ip ranges and domains of all utils.supported_orgs,
+        # merged so that checking an ip doesn't need a loop over the orgs.
+        # read from the db on first use by load_supported_orgs_info()
+        self.supported_orgs_asns: Set[str] = set()
+        self.supported_orgs_ranges: Dict[int, tuple] = build_ip_ranges([])
+        # {tld: [org domains with this tld]}
+        self.supported_orgs_domains: Dict[str, List[str]] = {}
+        # {tld: (regex that finds any of the org domains with this tld,
+        # the same domains joined by new lines)} so that a domain is
+        # compared to all of them with one search
+        self.supported_orgs_domain_matchers: Dict[str, tuple] = {}
+        # finds the name of any of the supported orgs in an ASN
+        self.supported_orgs_names: re.Pattern = re.compile(
+            "|".join(re.escape(org.upper()) for org in utils.supported_orgs)
+        )
+        self.supported_orgs_info_loaded = False
+        # {(ip, org): whether the ip belongs to the org}
+        self.ip_in_org_cache: Dict[Tuple[str, str], bool] = {}
 
     def read_configuration(self):
         conf = ConfigParser()
@@ -46,19 +233,38 @@ class Conn(IFlowalertsAnalyzer):
     def name(self) -> str:
         return "conn_analyzer"
 
+    def shutdown_gracefully(self):
+        self.conn_without_dns_timer.shutdown()
+        for profileid_twid in list(self.unsaved_reconnections):
+            profileid, _, twid = profileid_twid.rpartition("_")
+            self.save_reconnections(profileid, twid)
+        # the tws that weren't closed yet are never going to be closed
+        for profileid_twid in list(self.bytes_sent):
+            profileid, _, twid = profileid_twid.rpartition("_")
+            self.detect_data_upload_in_twid(profileid, twid)
+
     def check_long_connection(
-        self, dur, daddr, saddr, profileid, twid, uid, timestamp
+        self,
+        dur,
+        daddr,
+        saddr,
+        profileid,
+        twid,
+        uid,
+        timestamp,
+        saddr_obj=None,
+        daddr_obj=None,
     ):
         """
         Check if a duration of the connection is
         above the threshold (more than 25 minutes by default).
         :param dur: duration of the flow in seconds
+        :param saddr_obj: the parsed saddr, if the caller already has it
+        :param daddr_obj: the parsed daddr, if the caller already has it
         """
-
-        if (
-            ipaddress.ip_address(daddr).is_multicast
-            or ipaddress.ip_address(saddr).is_multicast
-        ):
+        saddr_obj = saddr_obj or get_ip_obj(saddr)
+        daddr_obj = daddr_obj or get_ip_obj(daddr)
+        if is_multicast(daddr_obj) or is_multicast(saddr_obj):
             # Do not check the duration of the flow
             return
 
@@ -78,16 +284,13 @@ class Conn(IFlowalertsAnalyzer):
         P2P is defined as following : proto is udp, port numbers are higher than 30000 at least 5 connections to different daddrs
         OR trying to connct to 1 ip on more than 5 unkown 30000+/udp ports
         """
-        if proto.lower() == "udp" and int(dport) > 30000:
-            try:
-                # trying to connct to 1 ip on more than 5 unknown ports
-                if self.p2p_daddrs[daddr] >= 6:
-                    return True
-                self.p2p_daddrs[daddr] = self.p2p_daddrs[daddr] + 1
-                # now check if we have more than 4 different dst ips
-            except KeyError:
-                # first time seeing this daddr
-                self.p2p_daddrs[daddr] = 1
+        if proto == "udp" and int(dport) > 30000:
+            # 0 if it's the first time seeing this daddr
+            conns_to_daddr: int = self.p2p_daddrs.get(daddr, 0)
+            # trying to connct to 1 ip on more than 5 unknown ports
+            if conns_to_daddr >= 6:
+                return True
+            self.p2p_daddrs[daddr] = conns_to_daddr + 1
 
             if len(self.p2p_daddrs) >= 5:
                 # this is another connection on port 3000+/udp and we already have 5 of them
@@ -96,6 +299,30 @@ class Conn(IFlowalertsAnalyzer):
 
         return False
 
+    def get_org_ranges(
+        self, portproto: str, org_ips: List[str]
+    ) -> Dict[int, Tuple[List[int], List[int]]]:
+        """
+        parses the ip ranges of the orgs known to use the given portproto
+        only once, and caches them as sorted non-overlapping int ranges
+        per ip version so that they can be searched using bisect
+        """
+        if portproto not in self.org_ranges:
+            self.org_ranges[portproto] = build_ip_ranges(org_ips)
+        return self.org_ranges[portproto]
+
+    def is_ip_in_org_ranges(self, ip: str, portproto: str, org_ips: list):
+        """
+        checks if the given ip belongs to any of the ranges of the orgs
+        known to use the given portproto
+        """
+        try:
+            ip_obj = get_ip_obj(ip)
+        except ValueError:
+            return False
+
+        return is_ip_in_ranges(ip_obj, self.get_org_ranges(portproto, org_ips))
+
     def port_belongs_to_an_org(self, daddr, portproto, profileid):
         """
         Checks wehether a port is known to be used by a specific
@@ -120,13 +347,12 @@ class Conn(IFlowalertsAnalyzer):
             # it's an ip and it belongs to this org, consider the port as known
             return True
 
-        for ip in org_ips:
-            # is any of them a range?
-            with contextlib.suppress(ValueError):
-                # we have the org range in our database, check if the daddr belongs to this range
-                if ipaddress.ip_address(daddr) in ipaddress.ip_network(ip):
-                    # it does, consider the port as known
-                    return True
+        # is any of them a range?
+        # we have the org range in our database, check if the daddr
+        # belongs to this range
+        if self.is_ip_in_org_ranges(daddr, portproto, org_ips):
+            # it does, consider the port as known
+            return True
 
         # not a range either since nothing is specified, e.g. ip is set to ""
         # check the source and dst mac address vendors
@@ -151,11 +377,26 @@ class Conn(IFlowalertsAnalyzer):
 
             # if it's an org that slips has info about (apple, fb, google,etc.),
             # check if the daddr belongs to it
-            if bool(self.whitelist.org_analyzer.is_ip_in_org(daddr, org_name)):
+            if self.is_ip_in_org(daddr, org_name):
                 return True
 
         return False
 
+    def is_ip_in_org(self, ip: str, org: str) -> bool:
+        """
+        cached version of org_analyzer.is_ip_in_org().
+        the same ips are checked against the same orgs over and over, and
+        the org ranges are loaded to the db once when slips starts
+        """
+        key = (ip, org)
+        if key not in self.ip_in_org_cache:
+            if len(self.ip_in_org_cache) >= IP_IN_ORG_CACHE_SIZE:
+                self.ip_in_org_cache.clear()
+            self.ip_in_org_cache[key] = bool(
+                self.whitelist.org_analyzer.is_ip_in_org(ip, org)
+            )
+        return self.ip_in_org_cache[key]
+
     def check_unknown_port(
         self, dport, proto, daddr, profileid, twid, uid, timestamp, state
     ):
@@ -204,22 +445,18 @@ class Conn(IFlowalertsAnalyzer):
         key = f"{saddr}-{daddr}-{dport}"
 
         # add this conn to the stored number of reconnections
-        current_reconnections = self.db.get_reconnections_for_tw(
-            profileid, twid
-        )
-
-        try:
-            reconnections, uids = current_reconnections[key]
-            reconnections += 1
-            uids.append(uid)
-            current_reconnections[key] = (reconnections, uids)
-        except KeyError:
-            current_reconnections[key] = (1, [uid])
-            reconnections = 1
-
-        if reconnections < 5:
+        current_reconnections = self.get_reconnections(profileid, twid)
+        # [number of reconnections, uids], updated in place
+        attempts: List = current_reconnections.setdefault(key, [0, []])
+        attempts[0] += 1
+        attempts[1].append(uid)
+
+        if attempts[0] < 5:
+            # the db is updated when the tw is closed
+            self.unsaved_reconnections.add(f"{profileid}_{twid}")
             return
 
+        reconnections, uids = attempts
         self.set_evidence.multiple_reconnection_attempts(
             profileid,
             twid,
@@ -229,71 +466,99 @@ class Conn(IFlowalertsAnalyzer):
             reconnections,
         )
         # reset the reconnection attempts of this src->dst
-        current_reconnections[key] = (0, [])
+        current_reconnections[key] = [0, []]
+        self.save_reconnections(profileid, twid)
+
+    def get_reconnections(self, profileid, twid) -> Dict[str, List]:
+        """
+        returns the reconnections of the given profile and tw.
+        they're read from the db once and kept in memory
+        until the tw is closed
+        """
+        profileid_twid = f"{profileid}_{twid}"
+        if profileid_twid not in self.reconnections:
+            self.reconnections[profileid_twid] = (
+                self.db.get_reconnections_for_tw(profileid, twid)
+            )
+        return self.reconnections[profileid_twid]
+
+    def save_reconnections(self, profileid, twid):
+        """stores the in-memory reconnections of the given tw in the db"""
+        profileid_twid = f"{profileid}_{twid}"
+        self.unsaved_reconnections.discard(profileid_twid)
+        if profileid_twid in self.reconnections:
+            self.db.setReconnections(
+                profileid, twid, self.reconnections[profileid_twid]
+            )
 
-        self.db.setReconnections(profileid, twid, current_reconnections)
+    def forget_reconnections(self, profileid, twid):
+        """
+        saves the reconnections of a closed tw to the db if they changed
+        and removes them from memory
+        """
+        profileid_twid = f"{profileid}_{twid}"
+        if profileid_twid in self.unsaved_reconnections:
+            self.save_reconnections(profileid, twid)
+        self.reconnections.pop(profileid_twid, None)
 
     def is_ignored_ip_data_upload(self, ip):
         """
         Ignore the IPs that we shouldn't alert about
         """
 
-        ip_obj = ipaddress.ip_address(ip)
-        if (
-            ip == self.gateway
-            or ip_obj.is_multicast
-            or ip_obj.is_link_local
-            or ip_obj.is_reserved
-        ):
+        if ip == self.get_gateway():
             return True
 
-        return False
+        # get_ip_obj() is cached and the rest are int comparisons for ipv4
+        return is_multicast_link_local_or_reserved(get_ip_obj(ip))
+
+    def get_gateway(self) -> Optional[str]:
+        """
+        returns the ip of the default gateway.
+        the gw may not be known when this analyzer starts, but once it's
+        set in the db it never changes, so it's only read until it's found
+        """
+        if not self.gateway:
+            self.gateway = self.db.get_gateway_ip()
+        return self.gateway
+
+    def add_sent_bytes(
+        self, sbytes: int, daddr, uid: str, profileid, twid, timestamp
+    ):
+        """
+        adds the bytes sent in the given flow to the total bytes sent
+        to the daddr in the given tw
+        """
+        bytes_sent = self.bytes_sent.setdefault(f"{profileid}_{twid}", {})
+        sent_to_daddr: list = bytes_sent.setdefault(daddr, [0, [], ""])
+        sent_to_daddr[0] += sbytes
+        sent_to_daddr[1].append(uid)
+        sent_to_daddr[2] = timestamp
 
     def get_sent_bytes(
-        self, all_flows: Dict[str, dict]
+        self, profileid, twid
     ) -> Dict[str, Tuple[int, List[str], str]]:
         """
-        Returns a dict of sent bytes to all ips in the all_flows dict
+        Returns a dict of sent bytes to all ips in the given tw and
+        removes them from memory
          {
             contacted_ip: (
-                sum_of_mbs_sent,
+                sum_of_bytes_sent,
                 [uids],
                 last_ts_of_flow_containging_this_contacted_ip
             )
         }
         """
-        bytes_sent = {}
-        for uid, flow in all_flows.items():
-            daddr = flow["daddr"]
-            sbytes: int = int(flow.get("sbytes", 0))
-            ts: str = flow.get("starttime", "")
-
-            if self.is_ignored_ip_data_upload(daddr) or not sbytes:
-                continue
-
-            if daddr in bytes_sent:
-                mbs_sent, uids, _ = bytes_sent[daddr]
-                mbs_sent += int(sbytes)
-                uids.append(uid)
-                bytes_sent[daddr] = (mbs_sent, uids, ts)
-            else:
-                bytes_sent[daddr] = (sbytes, [uid], ts)
-
-        return bytes_sent
+        bytes_sent = self.bytes_sent.pop(f"{profileid}_{twid}", {})
+        return {ip: tuple(sent) for ip, sent in bytes_sent.items()}
 
     def detect_data_upload_in_twid(self, profileid, twid):
         """
         For each contacted ip in this twid,
         check if the total bytes sent to this ip is >= data_exfiltration_threshold
         """
-        all_flows: Dict[str, dict] = self.db.get_all_flows_in_profileid(
-            profileid
-        )
-        if not all_flows:
-            return
-
         bytes_sent: Dict[str, Tuple[int, List[str], str]]
-        bytes_sent = self.get_sent_bytes(all_flows)
+        bytes_sent = self.get_sent_bytes(profileid, twid)
 
         for ip, ip_info in bytes_sent.items():
             ip_info: Tuple[int, List[str], str]
@@ -307,13 +572,14 @@ class Conn(IFlowalertsAnalyzer):
             )
 
     def check_device_changing_ips(
-        self, flow_type, smac, profileid, twid, uid, timestamp
+        self, flow_type, smac, profileid, profile_ip, twid, uid, timestamp
     ):
         """
         Every time we have a flow for a new ip
             (an ip that we're seeing for the first time)
         we check if the MAC of this srcip was associated with another ip
         this check is only done once for each source ip slips sees
+        :param profile_ip: the ip of the given profileid
         """
         if "conn" not in flow_type:
             return
@@ -321,11 +587,8 @@ class Conn(IFlowalertsAnalyzer):
         if not smac:
             return
 
-        saddr: str = profileid.split("_")[-1]
-        if not (
-            validators.ipv4(saddr)
-            and utils.is_private_ip(ipaddress.ip_address(saddr))
-        ):
+        saddr: str = profile_ip
+        if not (is_ipv4(saddr) and is_private_ip(get_ip_obj(saddr))):
             return
 
         if self.db.was_ip_seen_in_connlog_before(saddr):
@@ -340,7 +603,7 @@ class Conn(IFlowalertsAnalyzer):
             # has the given saddr and MAC
             # so this would be fp. so, make sure we're dealing with ipv4 only
             for ip in json.loads(old_ip_list):
-                if validators.ipv4(ip):
+                if is_ipv4(ip):
                     old_ip = ip
                     break
             else:
@@ -363,11 +626,15 @@ class Conn(IFlowalertsAnalyzer):
     ):
         """
         Set evidence when 1 flow is sending >= the flow_upload_threshold bytes
+        the sent bytes are also added to the total of this tw, to be
+        checked by detect_data_upload_in_twid() when the tw is closed
         """
         if not daddr or self.is_ignored_ip_data_upload(daddr) or not sbytes:
             return False
 
-        src_mbs = utils.convert_to_mb(int(sbytes))
+        sbytes = int(sbytes)
+        self.add_sent_bytes(sbytes, daddr, uid, profileid, twid, timestamp)
+        src_mbs = utils.convert_to_mb(sbytes)
         if src_mbs >= self.flow_upload_threshold:
             self.set_evidence.data_exfiltration(
                 daddr,
@@ -388,33 +655,54 @@ class Conn(IFlowalertsAnalyzer):
         """
         # we should ignore this evidence if the ip is ours, whether it's a
         # private ip or in the list of client_ips
+        # the checks are ordered by cost, the ones that need redis or the
+        # network are done last
         return (
             flow_type != "conn"
-            or appproto in ("dns", "icmp")
-            or utils.is_ignored_ip(daddr)
+            or appproto in IGNORED_APPPROTOS_FOR_CONN_WITHOUT_DNS
+            # because there's no dns.log to know if the dns was made
+            or self.input_type == "zeek_log_file"
             # if the daddr is a client ip, it means that this is a conn
             # from the internet to our ip, the dns res was probably
             # made on their side before connecting to us,
             # so we shouldn't be doing this detection on this ip
             or daddr in self.client_ips
-            # because there's no dns.log to know if the dns was made
-            or self.db.get_input_type() == "zeek_log_file"
-            or self.db.is_doh_server(daddr)
+            or utils.is_ignored_ip(daddr)
+            or self.is_doh_server(daddr)
             or self.dns_analyzer.is_dns_server(daddr)
         )
 
+    def is_doh_server(self, ip: str) -> bool:
+        """
+        checks if the given ip is a DoH server.
+        an ip is only marked as a DoH server in the db, never unmarked,
+        so positive answers are cached to avoid asking redis again
+        """
+        if ip in self.doh_servers:
+            return True
+
+        if self.db.is_doh_server(ip):
+            self.doh_servers.add(ip)
+            return True
+        return False
+
     def check_if_resolution_was_made_by_different_version(
-        self, profileid, daddr
+        self, profileid, daddr, dns_resolution: Optional[dict] = None
     ):
         """
         Sometimes the same computer makes dns requests using its ipv4 and ipv6 address, check if this is the case
+        :param dns_resolution: the resolution of the given daddr if the
+        caller already got it from the db
         """
         # get the other ip version of this computer
         other_ip = self.db.get_the_other_ip_version(profileid)
-        if other_ip:
-            other_ip = json.loads(other_ip)
+        if not other_ip:
+            return False
+        other_ip = json.loads(other_ip)
+
         # get the domain of this ip
-        dns_resolution = self.db.get_dns_resolution(daddr)
+        if dns_resolution is None:
+            dns_resolution = self.db.get_dns_resolution(daddr)
 
         try:
             if other_ip and other_ip in dns_resolution.get("resolved-by", []):
@@ -425,10 +713,19 @@ class Conn(IFlowalertsAnalyzer):
         return False
 
     def check_connection_without_dns_resolution(
-        self, flow_type, appproto, daddr, twid, profileid, timestamp, uid
+        self,
+        flow_type,
+        appproto,
+        daddr,
+        twid,
+        profileid,
+        profile_ip,
+        timestamp,
+        uid,
     ):
         """
         Checks if there's a flow to a dstip that has no cached DNS answer
+        :param profile_ip: the ip of the given profileid
         """
         # The exceptions are:
         # 1- Do not check for DNS requests
@@ -448,36 +745,42 @@ class Conn(IFlowalertsAnalyzer):
         # don't alert ConnectionWithoutDNS
         # until 30 minutes has passed
         # after starting slips because the dns may have happened before starting slips
-        if "-i" in sys.argv or self.db.is_growing_zeek_dir():
+        if self.is_running_non_stop:
             # connection without dns in case of an interface,
             # should only be detected from the srcip of this device,
             # not all ips, to avoid so many alerts of this type when port scanning
-            saddr = profileid.split("_")[-1]
-            if saddr not in self.our_ips:
+            if profile_ip not in self.our_ips:
                 return False
 
-            start_time = self.db.get_slips_start_time()
             now = datetime.now()
-            diff = utils.get_time_diff(start_time, now, return_type="minutes")
+            diff = utils.get_time_diff(
+                self.slips_start_time, now, return_type="minutes"
+            )
             if diff < self.conn_without_dns_interface_wait_time:
                 # less than 30 minutes have passed
                 return False
 
+        # the resolution is read once here and reused by the
+        # checks below instead of asking the db for it again
+        dns_resolution: dict = self.db.get_dns_resolution(daddr)
         # search 24hs back for a dns resolution
-        if self.db.is_ip_resolved(daddr, 24):
+        if self.db.is_ip_resolved(daddr, 24, dns_resolution=dns_resolution):
+            # the resolution arrived while we were waiting for it
+            self.connections_checked_in_conn_dns_timer_thread.discard(uid)
             return False
 
         if uid not in self.connections_checked_in_conn_dns_timer_thread:
             # comes here if we haven't started the timer
             # thread for this connection before
             # mark this connection as checked
-            self.connections_checked_in_conn_dns_timer_thread.append(uid)
+            self.connections_checked_in_conn_dns_timer_thread.add(uid)
             params = [
                 flow_type,
                 appproto,
                 daddr,
                 twid,
                 profileid,
+                profile_ip,
                 timestamp,
                 uid,
             ]
@@ -487,10 +790,9 @@ class Conn(IFlowalertsAnalyzer):
             # To give time to Slips to read all the files and get all the flows
             # don't alert a Connection Without DNS until 5 seconds has passed
             # in real time from the time of this checking.
-            timer = TimerThread(
+            self.conn_without_dns_timer.schedule(
                 15, self.check_connection_without_dns_resolution, params
             )
-            timer.start()
         else:
             # It means we already checked this conn with the Timer process
             # (we waited 15 seconds for the dns to arrive after
@@ -498,8 +800,12 @@ class Conn(IFlowalertsAnalyzer):
             # but still no dns resolution for it.
             # Sometimes the same computer makes requests using
             # its ipv4 and ipv6 address, check if this is the case
+            # This UID will never appear again, so we can remove it and
+            # free some memory
+            self.connections_checked_in_conn_dns_timer_thread.discard(uid)
+
             if self.check_if_resolution_was_made_by_different_version(
-                profileid, daddr
+                profileid, daddr, dns_resolution=dns_resolution
             ):
                 return False
 
@@ -511,10 +817,6 @@ class Conn(IFlowalertsAnalyzer):
             self.set_evidence.conn_without_dns(
                 daddr, timestamp, profileid, twid, uid
             )
-            # This UID will never appear again, so we can remove it and
-            # free some memory
-            with contextlib.suppress(ValueError):
-                self.connections_checked_in_conn_dns_timer_thread.remove(uid)
 
     def check_conn_to_port_0(
         self,
@@ -532,7 +834,7 @@ class Conn(IFlowalertsAnalyzer):
         Alerts on connections to or from port 0 using protocols other than
         igmp, icmp
         """
-        if proto.lower() in ("igmp", "icmp", "ipv6-icmp", "arp"):
+        if proto in PROTOS_WITHOUT_PORTS:
             return
 
         if sport != 0 and dport != 0:
@@ -563,8 +865,12 @@ class Conn(IFlowalertsAnalyzer):
         dport,
         timestamp,
         profileid,
+        profile_ip,
         twid,
     ):
+        """
+        :param profile_ip: the ip of the given profileid
+        """
         if proto != "tcp" or state != "Established":
             return
 
@@ -576,78 +882,41 @@ class Conn(IFlowalertsAnalyzer):
             # dport is known, we are considering only unknown services
             return
 
-        # Connection to multiple ports to the destination IP
-        if profileid.split("_")[1] == saddr:
-            direction = "Dst"
-            state = "Established"
-            protocol = "TCP"
-            role = "Client"
-            type_data = "IPs"
-
-            # get all the dst ips with established tcp connections
-            daddrs = self.db.get_data_from_profile_tw(
-                profileid,
-                twid,
-                direction,
-                state,
-                protocol,
-                role,
-                type_data,
-            )
-
-            # make sure we find established connections to this daddr
-            if daddr not in daddrs:
-                return
-
-            dstports = list(daddrs[daddr]["dstports"])
-            if len(dstports) <= 1:
-                return
-
-            uids = daddrs[daddr]["uid"]
-
-            victim: str = daddr
-            attacker: str = profileid.split("_")[-1]
-
-            self.set_evidence.connection_to_multiple_ports(
-                profileid,
-                twid,
-                uids,
-                timestamp,
-                dstports,
-                victim,
-                attacker,
-            )
+        if profile_ip == saddr:
+            # Connection to multiple ports to the destination IP
+            direction, role, other_ip = "Dst", "Client", daddr
+            victim, attacker = daddr, profile_ip
+        elif profile_ip == daddr:
+            # Connection to multiple port to the Source IP.
+            # Happens in the mode 'all'
+            direction, role, other_ip = "Src", "Server", saddr
+            victim, attacker = profile_ip, daddr
+        else:
+            return
 
-        # Connection to multiple port to the Source IP.
-        # Happens in the mode 'all'
-        elif profileid.split("_")[-1] == daddr:
-            direction = "Src"
-            state = "Established"
-            protocol = "TCP"
-            role = "Server"
-            type_data = "IPs"
-
-            # get all the src ips with established tcp connections
-            saddrs = self.db.get_data_from_profile_tw(
-                profileid,
-                twid,
-                direction,
-                state,
-                protocol,
-                role,
-                type_data,
-            )
-            dstports = list(saddrs[saddr]["dstports"])
-            if len(dstports) <= 1:
-                return
+        # get all the ips with established tcp connections in this
+        # direction. this is one hash field in the db, so it's read once
+        # per flow and only the other ip's entry is used
+        ips_data = self.db.get_data_from_profile_tw(
+            profileid, twid, direction, "Established", "TCP", role, "IPs"
+        )
+        # make sure we find established connections to/from the other ip
+        if other_ip not in ips_data:
+            return
 
-            uids = saddrs[saddr]["uid"]
-            attacker: str = daddr
-            victim: str = profileid.split("_")[-1]
+        other_ip_data: dict = ips_data[other_ip]
+        if len(other_ip_data["dstports"]) <= 1:
+            return
 
-            self.set_evidence.connection_to_multiple_ports(
-                profileid, twid, uids, timestamp, dstports, victim, attacker
-            )
+        self.set_evidence.connection_to_multiple_ports(
+            profileid,
+            twid,
+            other_ip_data["uid"],
+            timestamp,
+            list(other_ip_data["dstports"]),
+            victim,
+            attacker,
+        )
 
     def check_non_http_port_80_conns(
         self,
@@ -668,8 +937,8 @@ class Conn(IFlowalertsAnalyzer):
         # if it was a valid http conn, the 'service' field aka
         # appproto should be 'http'
         if (
-            str(dport) == "80"
-            and proto.lower() == "tcp"
+            dport == 80
+            and proto == "tcp"
             and appproto.lower() != "http"
             and state == "Established"
             and allbytes != 0
@@ -681,6 +950,8 @@ class Conn(IFlowalertsAnalyzer):
     def is_well_known_org(self, ip):
         """get the SNI, ASN, and  rDNS of the IP to check if it belongs
         to a well-known org"""
+        if ip in self.well_known_org_ips:
+            return True
 
         ip_data = self.db.get_ip_info(ip)
         try:
@@ -689,10 +960,10 @@ class Conn(IFlowalertsAnalyzer):
                 # SNI is a list of dicts, each dict contains the
                 # 'server_name' and 'port'
                 sni = sni[0]
-                if sni in (None, ""):
-                    sni = False
-                elif isinstance(sni, dict):
-                    sni = sni.get("server_name", False)
+            if sni in (None, ""):
+                sni = False
+            elif isinstance(sni, dict):
+                sni = sni.get("server_name", False)
         except (KeyError, TypeError):
             # No SNI data for this ip
             sni = False
@@ -704,23 +975,130 @@ class Conn(IFlowalertsAnalyzer):
             rdns = False
 
         flow_domains = [rdns, sni]
+        if self.is_in_supported_orgs(ip, ip_data, flow_domains):
+            self.well_known_org_ips.add(ip)
+            return True
+        return False
+
+    def load_supported_orgs_info(self):
+        """
+        reads the ASNs, ip ranges and domains of all the supported orgs
+        from the db once and merges them in one structure per info type
+        """
+        if self.supported_orgs_info_loaded:
+            return
+
+        asns = set()
+        networks = []
+        domains = {}
+        org_analyzer = self.whitelist.org_analyzer
         for org in utils.supported_orgs:
-            for domain in flow_domains:
-                if self.whitelist.org_analyzer.is_ip_asn_in_org_asn(ip, org):
-                    return True
-
-                # we have the rdns or sni of this flow , now check
-                if domain and self.whitelist.org_analyzer.is_domain_in_org(
-                    domain, org
-                ):
-                    return True
-
-                # check if the ip belongs to the range of a well known org
-                # (fb, twitter, microsoft, etc.)
-                if self.whitelist.org_analyzer.is_ip_in_org(ip, org):
-                    return True
+            asns.update(json.loads(self.db.get_org_info(org, "asn")))
+
+            for org_subnets in self.db.get_org_IPs(org).values():
+                networks.extend(org_subnets)
+
+            for org_domain in json.loads(self.db.get_org_info(org, "domains")):
+                tld = org_analyzer.domain_analyzer.get_tld(org_domain)
+                domains.setdefault(tld, []).append(org_domain)
+
+        if not (asns or networks or domains):
+            # the orgs info isn't in the db yet, try again next time
+            return
+
+        self.supported_orgs_asns = asns
+        self.supported_orgs_ranges = build_ip_ranges(networks)
+        self.supported_orgs_domains = domains
+        self.supported_orgs_domain_matchers = {
+            tld: (
+                re.compile("|".join(map(re.escape, tld_domains))),
+                "\n".join(tld_domains),
+            )
+            for tld, tld_domains in domains.items()
+        }
+        self.supported_orgs_info_loaded = True
+
+    def is_asn_in_supported_orgs(self, ip_data: dict) -> bool:
+        """checks if the asn in the given ip info belongs to an org"""
+        try:
+            ip_asn = ip_data["asn"]["number"]
+        except (KeyError, TypeError):
+            return False
+
+        if not ip_asn or ip_asn == "Unknown":
             return False
 
+        # because all ASN stored in slips organization_info/ are uppercase
+        ip_asn: str = ip_asn.upper()
+        if ip_asn in self.supported_orgs_asns:
+            return True
+        return bool(self.supported_orgs_names.search(ip_asn))
+
+    def is_domain_in_supported_orgs(self, domain: str) -> bool:
+        """
+        checks if the given domain or any of its subdomains belongs to an
+        org, only org domains with the same tld are compared
+        """
+        domain_analyzer = self.whitelist.org_analyzer.domain_analyzer
+        tld = domain_analyzer.get_tld(domain)
+        try:
+            org_domains_regex, org_domains = (
+                self.supported_orgs_domain_matchers[tld]
+            )
+        except KeyError:
+            return False
+
+        # match subdomains too.
+        # is any of the org domains in the given domain?
+        if org_domains_regex.search(domain):
+            return True
+        # or is the given domain part of any of the org domains?
+        return "\n" not in domain and domain in org_domains
+
+    def is_in_supported_orgs(
+        self, ip: str, ip_data: dict, flow_domains: list
+    ) -> bool:
+        """
+        checks if the given ip, its ASN or any of its domains belongs to
+        one of the orgs slips has info about
+        """
+        self.load_supported_orgs_info()
+
+        if self.is_asn_in_supported_orgs(ip_data):
+            return True
+
+        # check if the ip belongs to the range of a well known org
+        # (fb, twitter, microsoft, etc.)
+        with contextlib.suppress(ValueError):
+            if is_ip_in_ranges(get_ip_obj(ip), self.supported_orgs_ranges):
+                return True
+
+        # we have the rdns or sni of this flow , now check
+        for domain in flow_domains:
+            if (
+                domain
+                and isinstance(domain, str)
+                and self.is_domain_in_supported_orgs(domain)
+            ):
+                return True
+        return False
+
+    def get_localnet(self) -> Optional[Tuple[int, int]]:
+        """
+        returns our local network as a (network address, netmask) tuple
+        of ints, or None if the local network isn't set in the db yet
+        """
+        if self.localnet:
+            return self.localnet
+
+        own_local_network = self.db.get_local_network()
+        if not own_local_network:
+            return
+
+        net = ipaddress.IPv4Network(own_local_network)
+        self.localnet = (int(net.network_address), int(net.netmask))
+        return self.localnet
+
     def check_different_localnet_usage(
         self,
         saddr,
@@ -732,6 +1110,7 @@ class Conn(IFlowalertsAnalyzer):
         twid,
         uid,
         what_to_check="",
+        ip_obj=None,
     ):
         """
         alerts when a connection to a private ip that
@@ -740,22 +1119,28 @@ class Conn(IFlowalertsAnalyzer):
         If we are on 192.168.1.0/24 then detect anything
         coming from/to 10.0.0.0/8
         :param what_to_check: can be 'srcip' or 'dstip'
+        :param ip_obj: the parsed ip to check, if the caller already has it
         """
         ip_to_check = saddr if what_to_check == "srcip" else daddr
-        ip_obj = ipaddress.ip_address(ip_to_check)
-        own_local_network = self.db.get_local_network()
+        localnet = self.get_localnet()
 
-        if not own_local_network:
+        if not localnet:
             # the current local network wasn't set in the db yet
             # it's impossible to get here becaus ethe localnet is set before
             # any msg is published in the new_flow channel
             return
 
-        if not (validators.ipv4(ip_to_check) and utils.is_private_ip(ip_obj)):
+        if ip_obj is None:
+            if not is_ipv4(ip_to_check):
+                return
+            ip_obj = get_ip_obj(ip_to_check)
+
+        if ip_obj.version != 4 or not is_private_ip(ip_obj):
             return
 
         # if it's a private ipv4 addr, it should belong to our local network
-        if ip_obj in ipaddress.IPv4Network(own_local_network):
+        network_address, netmask = localnet
+        if int(ip_obj) & netmask == network_address:
             return
 
         self.set_evidence.different_localnet_usage(
@@ -777,30 +1162,29 @@ class Conn(IFlowalertsAnalyzer):
         twid,
         uid,
         timestamp,
+        saddr_obj=None,
+        daddr_obj=None,
     ):
         """
         Alerts when there's a connection from a private IP to
         another private IP except for DNS connections to the gateway
+        :param saddr_obj: the parsed saddr, if the caller already has it
+        :param daddr_obj: the parsed daddr, if the caller already has it
         """
 
         def is_dns_conn():
             return (
-                dport == 53
-                and proto.lower() == "udp"
-                and daddr == self.db.get_gateway_ip()
+                dport == 53 and proto == "udp" and daddr == self.get_gateway()
             )
 
-        with contextlib.suppress(ValueError):
-            dport = int(dport)
-
         if is_dns_conn():
             # skip DNS conns to the gw to avoid having tons of this evidence
             return
 
         # make sure the 2 ips are private
         if not (
-            utils.is_private_ip(ipaddress.ip_address(saddr))
-            and utils.is_private_ip(ipaddress.ip_address(daddr))
+            is_private_ip(saddr_obj or get_ip_obj(saddr))
+            and is_private_ip(daddr_obj or get_ip_obj(daddr))
         ):
             return
 
@@ -816,13 +1200,11 @@ class Conn(IFlowalertsAnalyzer):
 
     def analyze(self, msg):
         if utils.is_msg_intended_for(msg, "new_flow"):
-            new_flow = json.loads(msg["data"])
+            new_flow, uid, flow_dict = utils.parse_new_flow_msg(msg["data"])
             profileid = new_flow["profileid"]
+            # parse the ip of this profile once for all the detections
+            profile_ip: str = profileid.rpartition("_")[2]
             twid = new_flow["twid"]
-            flow = new_flow["flow"]
-            flow = json.loads(flow)
-            uid = next(iter(flow))
-            flow_dict = json.loads(flow[uid])
             # Flow type is 'conn' or 'dns', etc.
             flow_type = flow_dict["flow_type"]
             dur = flow_dict["dur"]
@@ -831,43 +1213,67 @@ class Conn(IFlowalertsAnalyzer):
             origstate = flow_dict["origstate"]
             state = flow_dict["state"]
             timestamp = new_flow["stime"]
-            sport: int = flow_dict["sport"]
-            dport: int = flow_dict.get("dport", None)
-            proto = flow_dict.get("proto")
+            # ports and protos are normalized once here for all the
+            # detections below
+            sport: int = port_to_int(flow_dict["sport"])
+            dport: int = port_to_int(flow_dict.get("dport", None))
+            proto: str = flow_dict.get("proto").lower()
             sbytes = flow_dict.get("sbytes", 0)
             appproto = flow_dict.get("appproto", "")
             smac = flow_dict.get("smac", "")
             allbytes = flow_dict.get("allbytes", 0)
             if not appproto or appproto == "-":
                 appproto = flow_dict.get("type", "")
+            # parse the ips once and share them with the detections below
+            saddr_obj = get_ip_obj(saddr)
+            daddr_obj = get_ip_obj(daddr)
 
             self.check_long_connection(
-                dur, daddr, saddr, profileid, twid, uid, timestamp
-            )
-            self.check_unknown_port(
-                dport,
-                proto.lower(),
+                dur,
                 daddr,
+                saddr,
                 profileid,
                 twid,
                 uid,
                 timestamp,
-                state,
+                saddr_obj=saddr_obj,
+                daddr_obj=daddr_obj,
             )
-            self.check_multiple_reconnection_attempts(
-                origstate, saddr, daddr, dport, uid, profileid, twid, timestamp
-            )
-            self.check_conn_to_port_0(
-                sport,
+            self.check_unknown_port(
                 dport,
                 proto,
-                saddr,
                 daddr,
                 profileid,
                 twid,
                 uid,
                 timestamp,
+                state,
             )
+            # the detections that apply to few flows are only called
+            # when their cheapest condition holds
+            if origstate == "REJ":
+                self.check_multiple_reconnection_attempts(
+                    origstate,
+                    saddr,
+                    daddr,
+                    dport,
+                    uid,
+                    profileid,
+                    twid,
+                    timestamp,
+                )
+            if sport == 0 or dport == 0:
+                self.check_conn_to_port_0(
+                    sport,
+                    dport,
+                    proto,
+                    saddr,
+                    daddr,
+                    profileid,
+                    twid,
+                    uid,
+                    timestamp,
+                )
             self.check_different_localnet_usage(
                 saddr,
                 daddr,
@@ -878,6 +1284,7 @@ class Conn(IFlowalertsAnalyzer):
                 twid,
                 uid,
                 what_to_check="srcip",
+                ip_obj=saddr_obj,
             )
             self.check_different_localnet_usage(
                 saddr,
@@ -889,56 +1296,80 @@ class Conn(IFlowalertsAnalyzer):
                 twid,
                 uid,
                 what_to_check="dstip",
+                ip_obj=daddr_obj,
             )
 
             self.check_connection_without_dns_resolution(
-                flow_type, appproto, daddr, twid, profileid, timestamp, uid
-            )
-
-            self.detect_connection_to_multiple_ports(
-                saddr,
-                daddr,
-                proto,
-                state,
+                flow_type,
                 appproto,
-                dport,
-                timestamp,
-                profileid,
+                daddr,
                 twid,
+                profileid,
+                profile_ip,
+                timestamp,
+                uid,
+            )
+
+            is_established_tcp: bool = (
+                proto == "tcp" and state == "Established"
             )
+            if is_established_tcp:
+                self.detect_connection_to_multiple_ports(
+                    saddr,
+                    daddr,
+                    proto,
+                    state,
+                    appproto,
+                    dport,
+                    timestamp,
+                    profileid,
+                    profile_ip,
+                    twid,
+                )
             self.check_data_upload(
                 sbytes, daddr, uid, profileid, twid, timestamp
             )
 
-            self.check_non_http_port_80_conns(
-                state,
-                daddr,
-                dport,
-                proto,
-                appproto,
-                allbytes,
-                profileid,
-                twid,
-                uid,
-                timestamp,
-            )
+            if is_established_tcp and dport == 80:
+                self.check_non_http_port_80_conns(
+                    state,
+                    daddr,
+                    dport,
+                    proto,
+                    appproto,
+                    allbytes,
+                    profileid,
+                    twid,
+                    uid,
+                    timestamp,
+                )
 
-            self.check_connection_to_local_ip(
-                daddr,
-                dport,
-                proto,
-                saddr,
-                twid,
-                uid,
-                timestamp,
-            )
+            if is_private_ip(daddr_obj):
+                self.check_connection_to_local_ip(
+                    daddr,
+                    dport,
+                    proto,
+                    saddr,
+                    twid,
+                    uid,
+                    timestamp,
+                    saddr_obj=saddr_obj,
+                    daddr_obj=daddr_obj,
+                )
 
-            self.check_device_changing_ips(
-                flow_type, smac, profileid, twid, uid, timestamp
-            )
+            if smac:
+                self.check_device_changing_ips(
+                    flow_type,
+                    smac,
+                    profileid,
+                    profile_ip,
+                    twid,
+                    uid,
+                    timestamp,
+                )
 
         if utils.is_msg_intended_for(msg, "tw_closed"):
-            profileid_tw = msg["data"].split("_")
-            profileid = f"{profileid_tw[0]}_{profileid_tw[1]}"
-            twid = profileid_tw[-1]
+            # msg["data"] is profile_<ip>_timewindow<n>
+            profileid, _, twid = msg["data"].rpartition("_")
             self.detect_data_upload_in_twid(profileid, twid)
+            self.forget_reconnections(profileid, twid)
@@ -1,12 +1,18 @@
 import collections
 import contextlib
+import ipaddress
 import json
 import math
-from typing import List
+import re
+import threading
+import time
+from functools import lru_cache
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
 import dns.resolver
 import dns.query
 import dns.message
-import validators
+import numpy as np
 
 from modules.flowalerts.timer_thread import TimerThread
 from slips_files.common.abstracts.flowalerts_analyzer import (
@@ -16,23 +22,63 @@ from slips_files.common.parsers.config_parser import ConfigParser
 from slips_files.common.slips_utils import utils
 from slips_files.core.evidence_structure.evidence import Direction
 
+# chars an ipv4 or ipv6 can have, used to skip the answers that can't be
+# ips (domains, TXT records, etc.) without parsing them
+IP_CHARS = re.compile(r"[0-9a-fA-F:.]+")
+
+# how long the result of probing an ip in is_dns_server() is reused, in
+# seconds. servers can be started or stopped while slips is running
+DNS_SERVER_CACHE_TTL = 3600
+# max number of probed ips kept in the is_dns_server() cache
+DNS_SERVER_CACHE_SIZE = 1024
+# how long a domain age read from the db is reused, in seconds, and how
+# many domain ages are kept
+DOMAIN_AGE_CACHE_TTL = 86400
+DOMAIN_AGE_CACHE_SIZE = 16384
+# reverse dns lookups of ipv4 and ipv6 addresses
+ARPA_SUFFIXES = (".in-addr.arpa", ".ip6.arpa")
+# answers given to blocked domains (perhaps by ad blockers)
+INVALID_ANSWERS = frozenset({"127.0.0.1", "0.0.0.0"})
+
+
+def is_ip(answer: str) -> bool:
+    """
+    cheaper than validators.ipv4() or validators.ipv6() for checking
+    every answer of every dns flow
+    """
+    if not IP_CHARS.fullmatch(answer):
+        return False
+    try:
+        ipaddress.ip_address(answer)
+        return True
+    except ValueError:
+        return False
+
 
 class DNS(IFlowalertsAnalyzer):
     def init(self):
         self.read_configuration()
-        # this dict will contain the number of nxdomains
-        # found in every profile
-        self.nxdomains = {}
+        # the unique nxdomains found in every profile and tw, and their uids
+        # {profileid_twid: deque([(query, uid), ...])}
+        self.nxdomains: Dict[str, Deque[Tuple[str, str]]] = {}
         # if nxdomains are >= this threshold, it's probably DGA
         self.nxdomains_threshold = 10
         # Cache list of connections that we already checked in the timer
         # thread (we waited for the connection of these dns resolutions)
         self.connections_checked_in_dns_conn_timer_thread = []
         # dict to keep track of arpa queries to check for DNS arpa scans later
-        # format {profileid: [ts,ts,...]}
-        self.dns_arpa_queries = {}
+        # format {profileid: deque([(stime, uid, domain), ...])}
+        self.dns_arpa_queries: Dict[str, Deque[Tuple[str, str, str]]] = {}
         # after this number of arpa queries, slips will detect an arpa scan
         self.arpa_scan_threshold = 10
+        # cache of the ips we already probed in is_dns_server()
+        # {ip: (expiry, is_dns_server)}
+        self.dns_servers: Dict[str, Tuple[float, bool]] = {}
+        # cache of the domain ages read in get_domain_age()
+        # {domain: (expiry, age)}
+        self.domain_ages: Dict[str, Tuple[float, int]] = {}
+        # is_dns_server() is also called from the conn timer threads
+        self.cache_lock = threading.Lock()
 
     def name(self) -> str:
         return "DNS_analyzer"
@@ -43,16 +89,34 @@ class DNS(IFlowalertsAnalyzer):
 
     def is_dns_server(self, ip: str) -> bool:
         """checks if the given IP is a DNS server by making a query and
-        waiting for a response"""
+        waiting for a response.
+        each ip is only probed once every DNS_SERVER_CACHE_TTL, since the
+        query may take up to 2s"""
+        now = time.monotonic()
+        with self.cache_lock:
+            if cached := self.dns_servers.get(ip):
+                expiry, is_dns_server = cached
+                if now < expiry:
+                    return is_dns_server
+                self.dns_servers.pop(ip, None)
+
         try:
             query = dns.message.make_query("google.com", dns.rdatatype.A)
             dns.query.udp(query, ip, timeout=2)
-            return True
+            is_dns_server = True
         except Exception:
             # If there's any error, the IP is probably not a DNS server
-            return False
+            is_dns_server = False
+
+        with self.cache_lock:
+            if len(self.dns_servers) >= DNS_SERVER_CACHE_SIZE:
+                # drop the oldest probed ip
+                self.dns_servers.pop(next(iter(self.dns_servers), None), None)
+            self.dns_servers[ip] = (now + DNS_SERVER_CACHE_TTL, is_dns_server)
+        return is_dns_server
 
     @staticmethod
+    @lru_cache(maxsize=8192)
     def should_detect_dns_without_conn(domain: str, rcode_name: str) -> bool:
         """
         returns False in the following cases
@@ -68,13 +132,15 @@ class DNS(IFlowalertsAnalyzer):
          - When there is an NXDOMAIN as answer, it means
          the domain isn't resolved, so we should not expect any
             connection later
+        the result is cached since the same domains are queried over and
+        over
         """
         if (
             "arpa" in domain
             or ".local" in domain
             or "*" in domain
             or ".cymru.com" in domain[-10:]
-            or len(domain.split(".")) == 1
+            or "." not in domain
             or domain == "WPAD"
             or rcode_name != "NOERROR"
         ):
@@ -85,15 +151,14 @@ class DNS(IFlowalertsAnalyzer):
         """
         check if any ip of the given CNAMEs is contacted
         """
-        for CNAME in answers:
-            if not utils.is_valid_domain(CNAME):
-                # it's an ip
-                continue
-            ips = self.db.get_domain_resolution(CNAME)
-            for ip in ips:
-                if ip in contacted_ips:
-                    return True
-        return False
+        # skip the ips in the answers
+        cnames = [
+            answer for answer in answers if utils.is_valid_domain(answer)
+        ]
+        if not cnames:
+            return False
+        ips = self.db.get_domains_resolutions(cnames)
+        return not contacted_ips.keys().isdisjoint(ips)
 
     @staticmethod
     def should_detect_young_domain(domain):
@@ -107,6 +172,33 @@ class DNS(IFlowalertsAnalyzer):
             and not domain.endswith(".arpa")
         )
 
+    def get_domain_age(self, domain: str) -> Optional[int]:
+        """
+        returns the age of the given domain in days, or None if we don't
+        have age info about it yet.
+        known ages are cached for DOMAIN_AGE_CACHE_TTL, missing ones
+        aren't, because ip_info may store the age of the domain later
+        """
+        now = time.monotonic()
+        with self.cache_lock:
+            if cached := self.domain_ages.get(domain):
+                expiry, age = cached
+                if now < expiry:
+                    return age
+                self.domain_ages.pop(domain, None)
+
+        domain_info: dict = self.db.get_domain_data(domain)
+        if not domain_info or "Age" not in domain_info:
+            return None
+
+        age = domain_info["Age"]
+        with self.cache_lock:
+            if len(self.domain_ages) >= DOMAIN_AGE_CACHE_SIZE:
+                # drop the oldest cached domain
+                self.domain_ages.pop(next(iter(self.domain_ages), None), None)
+            self.domain_ages[domain] = (now + DOMAIN_AGE_CACHE_TTL, age)
+        return age
+
     def detect_young_domains(
         self, domain, answers: List[str], stime, profileid, twid, uid
     ):
@@ -119,16 +211,12 @@ class DNS(IFlowalertsAnalyzer):
 
         age_threshold = 60
 
-        domain_info: dict = self.db.get_domain_data(domain)
-        if not domain_info:
-            return False
-
-        if "Age" not in domain_info:
+        # age is in days
+        age = self.get_domain_age(domain)
+        if age is None:
             # we don't have age info about this domain
             return False
 
-        # age is in days
-        age = domain_info["Age"]
         if age >= age_threshold:
             return False
 
@@ -145,15 +233,15 @@ class DNS(IFlowalertsAnalyzer):
         """
         extracts ipv4 and 6 from DNS answers
         """
-        ips = []
-        for answer in answers:
-            if validators.ipv4(answer) or validators.ipv6(answer):
-                ips.append(answer)
-        return ips
+        return [answer for answer in answers if is_ip(answer)]
 
-    def is_connection_made_by_different_version(self, profileid, twid, daddr):
+    def is_connection_made_by_different_version(
+        self, profileid, twid, ips: List[str]
+    ) -> bool:
         """
-        :param daddr: the ip this connection is made to (destination ip)
+        checks if any of the given ips was contacted by the other ip
+        version (v4/v6) of this computer in the given tw
+        :param ips: the ips the dns answers resolved to
         """
         # get the other ip version of this computer
         other_ip = self.db.get_the_other_ip_version(profileid)
@@ -166,11 +254,9 @@ class DNS(IFlowalertsAnalyzer):
         )
         if not contacted_ips:
             return False
-
-        if daddr in contacted_ips:
-            # now we're sure that the connection was made
-            # by this computer but using a different ip version
-            return True
+        # if any of them was contacted, we're sure that the connection
+        # was made by this computer but using a different ip version
+        return not contacted_ips.keys().isdisjoint(ips)
 
     def check_dns_without_connection(
         self,
@@ -231,16 +317,16 @@ class DNS(IFlowalertsAnalyzer):
         # every dns answer is a list of ips that correspond to 1 query,
         # one of these ips should be present in the contacted ips
         # check each one of the resolutions of this domain
-        for ip in self.extract_ips_from_dns_answers(answers):
-            # self.print(f'Checking if we have a connection to ip {ip}')
-            if (
-                ip in contacted_ips
-                or self.is_connection_made_by_different_version(
-                    profileid, twid, ip
-                )
-            ):
-                # this dns resolution has a connection. We can exit
-                return False
+        # the other ip version's contacted ips are only fetched once per
+        # check, not once per answer
+        ips = self.extract_ips_from_dns_answers(answers)
+        if not contacted_ips.keys().isdisjoint(
+            ips
+        ) or self.is_connection_made_by_different_version(
+            profileid, twid, ips
+        ):
+            # this dns resolution has a connection. We can exit
+            return False
 
         # Check if there was a connection to any of the CNAMEs
         if self.is_cname_contacted(answers, contacted_ips):
@@ -282,7 +368,20 @@ class DNS(IFlowalertsAnalyzer):
                 self.connections_checked_in_dns_conn_timer_thread.remove(uid)
 
     @staticmethod
+    @lru_cache(maxsize=4096)
     def estimate_shannon_entropy(string):
+        """
+        the result is cached because the same TXT answers (spf, dkim,
+        verification records) are seen over and over
+        """
+        if not string:
+            return 0
+        if string.isascii():
+            # each ascii char is 1 byte, so the bytes can be counted in C
+            counts = np.bincount(np.frombuffer(string.encode(), np.uint8))
+            probabilities = counts[counts > 0] / len(string)
+            return float(-(probabilities * np.log2(probabilities)).sum())
+
         m = len(string)
         bases = collections.Counter(list(string))
         shannon_entropy_value = 0
@@ -306,20 +405,26 @@ class DNS(IFlowalertsAnalyzer):
         if not answers:
             return
 
+        # the entropy of a string can't be higher than log2 of its length,
+        # so answers shorter than this can never reach the threshold
+        min_length = 2**self.shannon_entropy_threshold
+        # zeek prefixes TXT answers with their type, so there's no need to
+        # search the whole answer
         for answer in answers:
-            if "TXT" in answer:
-                entropy = self.estimate_shannon_entropy(answer)
-                if entropy >= self.shannon_entropy_threshold:
-                    self.set_evidence.suspicious_dns_answer(
-                        domain,
-                        answer,
-                        entropy,
-                        daddr,
-                        profileid,
-                        twid,
-                        stime,
-                        uid,
-                    )
+            if not answer.startswith("TXT") or len(answer) < min_length:
+                continue
+            entropy = self.estimate_shannon_entropy(answer)
+            if entropy >= self.shannon_entropy_threshold:
+                self.set_evidence.suspicious_dns_answer(
+                    domain,
+                    answer,
+                    entropy,
+                    daddr,
+                    profileid,
+                    twid,
+                    stime,
+                    uid,
+                )
 
     def check_invalid_dns_answers(
         self, domain, answers, profileid, twid, stime, uid
@@ -328,12 +433,11 @@ class DNS(IFlowalertsAnalyzer):
         # answers to DNS queries being blocked
         # (perhaps by ad blockers) and set to the following IP values
         # currently hardcoding blocked ips
-        invalid_answers = {"127.0.0.1", "0.0.0.0"}
-        if not answers:
+        if not answers or domain == "localhost":
             return
 
         for answer in answers:
-            if answer in invalid_answers and domain != "localhost":
+            if answer in INVALID_ANSWERS:
                 # blocked answer found
                 self.set_evidence.invalid_dns_answer(
                     domain, answer, profileid, twid, stime, uid
@@ -352,94 +456,93 @@ class DNS(IFlowalertsAnalyzer):
         if not rcode_name:
             return
 
-        # check whitelisted queries because we
-        # don't want to count nxdomains to cymru.com or
-        # spamhaus as DGA as they're made
-        # by slips
         if (
             "NXDOMAIN" not in rcode_name
             or not query
             or query.endswith(".arpa")
             or query.endswith(".local")
-            or self.flowalerts.whitelist.domain_analyzer.is_whitelisted(
-                query, Direction.SRC, "alerts"
-            )
         ):
             return False
 
         profileid_twid = f"{profileid}_{twid}"
 
         # found NXDOMAIN by this profile
-        try:
-            # make sure all domains are unique
-            if query not in self.nxdomains[profileid_twid]:
-                queries, uids = self.nxdomains[profileid_twid]
-                queries.append(query)
-                uids.append(uid)
-                self.nxdomains[profileid_twid] = (queries, uids)
-        except KeyError:
+        nxdomains = self.nxdomains.get(profileid_twid)
+        # make sure all domains are unique. a query that was already
+        # counted in this tw passed the whitelist check before, so
+        # repeated nxdomains don't go through the whitelist again
+        if nxdomains and any(
+            query == seen_query for seen_query, _ in nxdomains
+        ):
+            return False
+
+        # check whitelisted queries because we
+        # don't want to count nxdomains to cymru.com or
+        # spamhaus as DGA as they're made
+        # by slips
+        if self.flowalerts.whitelist.domain_analyzer.is_whitelisted(
+            query, Direction.SRC, "alerts"
+        ):
+            return False
+
+        if nxdomains is None:
             # first time seeing nxdomain in this profile and tw
-            self.nxdomains.update({profileid_twid: ([query], [uid])})
+            self.nxdomains[profileid_twid] = deque(
+                [(query, uid)], maxlen=self.nxdomains_threshold
+            )
             return False
 
+        nxdomains.append((query, uid))
+
         # every 5 nxdomains, generate an alert.
-        queries, uids = self.nxdomains[profileid_twid]
-        number_of_nxdomains = len(queries)
+        number_of_nxdomains = len(nxdomains)
         if (
             number_of_nxdomains % 5 == 0
             and number_of_nxdomains >= self.nxdomains_threshold
         ):
+            uids = [nxdomain_uid for _, nxdomain_uid in nxdomains]
             self.set_evidence.dga(
                 number_of_nxdomains, stime, profileid, twid, uids
             )
-            # clear the list of alerted queries and uids
-            self.nxdomains[profileid_twid] = ([], [])
+            # clear the alerted queries and uids
+            nxdomains.clear()
             return True
 
     def check_dns_arpa_scan(self, domain, stime, profileid, twid, uid):
         """
         Detect and ARPA scan if an ip performed 10(arpa_scan_threshold)
-        or more arpa queries within 2 seconds
+        or more arpa queries to different hosts within 2 seconds
         """
-        if not domain:
-            return False
-        if not domain.endswith(".in-addr.arpa"):
+        if not domain or not domain.endswith(ARPA_SUFFIXES):
             return False
 
-        try:
-            # format of this dict is
-            # {profileid: [stime of first arpa query, stime of second, etc..]}
-            timestamps, uids, domains_scanned = self.dns_arpa_queries[
-                profileid
-            ]
-            timestamps.append(stime)
-            uids.append(uid)
-            uids.append(uid)
-            domains_scanned.add(domain)
-            self.dns_arpa_queries[profileid] = (
-                timestamps,
-                uids,
-                domains_scanned,
-            )
-        except KeyError:
+        # the last arpa_scan_threshold arpa queries of this profile, to
+        # different domains
+        # format is deque([(stime, uid, domain), ...])
+        queries = self.dns_arpa_queries.get(profileid)
+        if queries is None:
             # first time for this profileid to perform an arpa query
-            self.dns_arpa_queries[profileid] = ([stime], [uid], {domain})
+            queries = deque(maxlen=self.arpa_scan_threshold)
+            self.dns_arpa_queries[profileid] = queries
+        elif any(domain == scanned for _, _, scanned in queries):
             return False
 
-        if len(domains_scanned) < self.arpa_scan_threshold:
+        queries.append((stime, uid, domain))
+        if len(queries) < self.arpa_scan_threshold:
             # didn't reach the threshold yet
             return False
 
         # reached the threshold, did the 10 queries happen within 2 seconds?
-        diff = utils.get_time_diff(timestamps[0], timestamps[-1])
+        diff = utils.get_time_diff(queries[0][0], queries[-1][0])
         if diff > 2:
             # happened within more than 2 seconds
             return False
 
+        uids = [query_uid for _, query_uid, _ in queries]
         self.set_evidence.dns_arpa_scan(
             self.arpa_scan_threshold, stime, profileid, twid, uids
         )
-        # empty the list of arpa queries for this profile,
+        # empty the arpa queries of this profile,
         # we don't need them anymore
         self.dns_arpa_queries.pop(profileid)
         return True
@@ -453,9 +556,7 @@ class DNS(IFlowalertsAnalyzer):
         twid = data["twid"]
         uid = data["uid"]
         daddr = data.get("daddr", False)
-        flow_data = json.loads(
-            data["flow"]
-        )  # this is a dict {'uid':json flow data}
+        flow_data: dict = data["flow"]
         domain = flow_data.get("query", False)
         answers = flow_data.get("answers", False)
         rcode_name = flow_data.get("rcode_name", False)
@@ -467,21 +568,23 @@ class DNS(IFlowalertsAnalyzer):
         # 1 fo ipv6, both have the
         # same uid, this causes FP dns without connection,
         # so make sure we only check the uid once
-        if (
-            answers
-            and uid not in self.connections_checked_in_dns_conn_timer_thread
-        ):
-            self.check_dns_without_connection(
-                domain, answers, rcode_name, stime, profileid, twid, uid
+        if answers:
+            if uid not in self.connections_checked_in_dns_conn_timer_thread:
+                self.check_dns_without_connection(
+                    domain, answers, rcode_name, stime, profileid, twid, uid
+                )
+
+            self.check_high_entropy_dns_answers(
+                domain, answers, daddr, profileid, twid, stime, uid
             )
 
-        self.check_high_entropy_dns_answers(
-            domain, answers, daddr, profileid, twid, stime, uid
-        )
+            self.check_invalid_dns_answers(
+                domain, answers, profileid, twid, stime, uid
+            )
 
-        self.check_invalid_dns_answers(
-            domain, answers, profileid, twid, stime, uid
-        )
+        # the rest of the detections are about the query
+        if not domain:
+            return
 
         self.detect_dga(rcode_name, domain, stime, profileid, twid, uid)
 
@@ -51,6 +51,9 @@ class FlowAlerts(IModule):
             channel_obj = self.db.subscribe(channel)
             self.channels.update({channel: channel_obj})
 
+    def shutdown_gracefully(self):
+        self.conn.shutdown_gracefully()
+
     def pre_main(self):
         utils.drop_root_privs()
         self.analyzers_map = {
@@ -200,17 +200,18 @@ class SSL(IFlowalertsAnalyzer):
             found_org_in_cn, timestamp, daddr, profileid, twid, uid
         )
 
-    def check_non_ssl_port_443_conns(self, msg):
+    def check_non_ssl_port_443_conns(
+        self, msg: dict, uid: str, flow_dict: dict
+    ):
         """
         alerts on established connections on port 443 that are not HTTPS (ssl)
+        :param msg: the decoded msg of the new_flow channel
+        :param uid: uid of the flow in the given msg
+        :param flow_dict: the decoded flow of the given msg
         """
         profileid = msg["profileid"]
         twid = msg["twid"]
         timestamp = msg["stime"]
-        flow = msg["flow"]
-        flow = json.loads(flow)
-        uid = next(iter(flow))
-        flow_dict = json.loads(flow[uid])
         daddr = flow_dict["daddr"]
         state = flow_dict["state"]
         dport: int = flow_dict.get("dport", None)
@@ -299,5 +300,5 @@ class SSL(IFlowalertsAnalyzer):
             )
 
         if utils.is_msg_intended_for(msg, "new_flow"):
-            new_flow = json.loads(msg["data"])
-            self.check_non_ssl_port_443_conns(new_flow)
+            new_flow, uid, flow_dict = utils.parse_new_flow_msg(msg["data"])
+            self.check_non_ssl_port_443_conns(new_flow, uid, flow_dict)
@@ -1,4 +1,10 @@
+import heapq
+import itertools
 import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Callable, List, Optional, Tuple
 
 
 class TimerThread(threading.Thread):
@@ -32,3 +38,121 @@ class TimerThread(threading.Thread):
     def task(self):
         # print(f'Executing the function with {self.parameters} on {datetime.datetime.now()}')
         self.function(*self.parameters)
+
+
+class TimerScheduler(threading.Thread):
+    """
+    One thread that executes many tasks, each one after its own
+    N seconds. Use it instead of starting one TimerThread per task when
+    there may be thousands of tasks waiting at the same time.
+    Due tasks are run by a small pool of workers so that one slow task
+    doesn't delay the ones after it.
+    The thread is started when the first task is scheduled.
+    """
+
+    def __init__(self, print_func: Callable, max_workers: int = 4):
+        """
+        :param print_func: the print() of the module using this
+        scheduler, used to log the errors of the tasks
+        :param max_workers: max number of tasks running at the same time
+        """
+        threading.Thread.__init__(self, daemon=True)
+        self.print = print_func
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        # min heap of (time_to_run, task_number, function, parameters)
+        self._tasks: List[Tuple[float, int, Callable, list]] = []
+        # task numbers keep the tasks that should run at the same time
+        # in the order they were scheduled, and prevent the heap from
+        # ever comparing functions
+        self._task_number = itertools.count()
+        self._condition = threading.Condition()
+        self._finished = False
+
+    def schedule(self, interval: float, function: Callable, parameters):
+        """runs function(*parameters) after interval seconds"""
+        with self._condition:
+            if not self.is_alive() and not self._finished:
+                self.start()
+            heapq.heappush(
+                self._tasks,
+                (
+                    time.monotonic() + interval,
+                    next(self._task_number),
+                    function,
+                    parameters,
+                ),
+            )
+            self._condition.notify()
+
+    def shutdown(self):
+        """
+        Stops this thread. Tasks that didn't run yet are run right away
+        instead of being discarded, and this waits for all of them to
+        finish
+        """
+        with self._condition:
+            self._finished = True
+            self._condition.notify()
+        if self.is_alive():
+            self.join()
+
+    def get_next_task(self) -> Optional[Tuple[Callable, list]]:
+        """
+        blocks until the next task is due and returns it.
+        returns None when the scheduler is shut down
+        """
+        with self._condition:
+            while not self._finished:
+                if not self._tasks:
+                    self._condition.wait()
+                    continue
+
+                time_to_run = self._tasks[0][0]
+                delay = time_to_run - time.monotonic()
+                if delay <= 0:
+                    _, _, function, parameters = heapq.heappop(self._tasks)
+                    return function, parameters
+                self._condition.wait(delay)
+
+    def get_pending_tasks(self) -> List[Tuple[Callable, list]]:
+        """removes and returns all the tasks that didn't run yet"""
+        with self._condition:
+            tasks = [
+                (function, parameters)
+                for _, _, function, parameters in sorted(self._tasks)
+            ]
+            self._tasks.clear()
+            return tasks
+
+    def run_task(self, function: Callable, parameters):
+        try:
+            function(*parameters)
+        except Exception:
+            # one failing task shouldn't stop the rest
+            self.print(f"Problem running the scheduled {function}", 0, 1)
+            self.print(traceback.format_exc(), 0, 1)
+
+    def run_pending_tasks(self):
+        """
+        runs the tasks left when the scheduler is shut down without
+        waiting for their time, until no task schedules new ones
+        """
+        while tasks := self.get_pending_tasks():
+            futures = [
+                self._pool.submit(self.run_task, function, parameters)
+                for function, parameters in tasks
+            ]
+            wait(futures)
+
+    def run(self):
+        try:
+            while task := self.get_next_task():
+                function, parameters = task
+                # tasks run outside the lock so that they're able to
+                # schedule new tasks
+                self._pool.submit(self.run_task, function, parameters)
+            self.run_pending_tasks()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._pool.shutdown(wait=True)
@@ -624,9 +624,7 @@ class IPInfo(IModule):
             # profileid = data['profileid']
             # twid = data['twid']
             # uid = data['uid']
-            flow_data = json.loads(
-                data["flow"]
-            )  # this is a dict {'uid':json flow data}
+            flow_data: dict = data["flow"]
             if domain := flow_data.get("query", False):
                 self.get_age(domain)
 
@@ -1,13 +1,62 @@
 import traceback
 import sys
 import time
-import json
-from typing import Any
+from collections import deque
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    Any,
+    Deque,
+    Dict,
+    List,
+    Optional,
+)
 
 from slips_files.common.parsers.config_parser import ConfigParser
 from slips_files.common.slips_utils import utils
 from slips_files.common.abstracts.module import IModule
 
+# how long to wait for the altflow of a flow (dns, http, ssl, etc.) to be
+# stored in the db before adding the flow to the timeline without it
+ALTFLOW_WAIT_TIME = 0.05
+# max number of new flows to read from the channel in one main() loop
+MAX_FLOWS_PER_BATCH = 128
+# names of the icmp types as given in the sport of zeek flows
+ZEEK_ICMP_TYPES = {
+    11: "ICMP Time Exceeded in Transit",
+    3: "ICMP Destination Net Unreachable",
+    8: "PING echo",
+}
+# names of the icmp types and codes as given in the sport of argus flows
+ARGUS_ICMP_TYPES = {
+    "0x0008": "PING echo",
+    "0x0103": "ICMP Host Unreachable",
+    "0x0303": "ICMP Port Unreachable",
+    "0x000b": "",
+    "0x0003": "ICMP Destination Net Unreachable",
+}
+# number of threads that create the activities of the flows of a batch.
+# most of the work is waiting for the db, so threads help here
+FLOW_PROCESSING_THREADS = 4
+# max seconds to wait for a new flow when there's nothing else to do
+MAX_IDLE_WAIT_TIME = 0.5
+# how long the dns resolution of an ip is reused before reading it from the
+# db again, in seconds. ips get new resolutions while slips is running
+DNS_RESOLUTION_CACHE_TTL = 60
+# max number of ips/ports to keep in each of the caches of this module
+CACHE_SIZE = 8192
+
+
+def get_duration(flow: dict) -> float:
+    """
+    returns the dur of the given flow rounded to 3 decimals.
+    zeek conn flows already have it as a float, other flows have it as str
+    """
+    dur = flow["dur"]
+    if type(dur) is not float:
+        dur = float(dur)
+    return round(dur, 3)
+
 
 class Timeline(IModule):
     # Name: short name of the module. Do not use spaces
@@ -17,6 +66,22 @@ class Timeline(IModule):
         " network based on flows and available data"
     )
     authors = ["Sebastian Garcia"]
+    # names of the methods that create the activity of each flow proto
+    proto_handlers = {
+        "TCP": "process_tcp_udp_flow",
+        "UDP": "process_tcp_udp_flow",
+        "ICMP": "process_icmp_flow",
+        "IPV6-ICMP": "process_icmp_flow",
+        "IPV4-ICMP": "process_icmp_flow",
+        "IGMP": "process_igmp_flow",
+    }
+    # names of the methods that create the activity of each altflow type
+    altflow_handlers = {
+        "dns": "process_dns_altflow",
+        "http": "process_http_altflow",
+        "ssl": "process_ssl_altflow",
+        "ssh": "process_ssh_altflow",
+    }
 
     def init(self):
         self.separator = self.db.get_field_separator()
@@ -28,12 +93,36 @@ class Timeline(IModule):
         # Read information how we should print timestamp.
         conf = ConfigParser()
         self.is_human_timestamp = conf.timeline_human_timestamp()
+        self.human_timestamp_format = utils.alerts_format
         self.analysis_direction = conf.analysis_direction()
+        # flows that had no altflow in the db when they were processed.
+        # (deadline, profileid, twid, uid, activity, timestamp) tuples,
+        # sorted by deadline because they all wait the same time
+        self.pending_altflows: Deque[tuple] = deque()
+        # {ip: (expiry time, dns resolution of this ip)}
+        self.dns_resolutions: Dict[str, tuple] = {}
+        # {"port/proto": name of the port or None if unknown}
+        self.ports_info: Dict[str, Optional[str]] = {}
+        # the threads are only started when the first batch is submitted,
+        # so this is safe to create before this process is forked
+        self.flow_processors = ThreadPoolExecutor(
+            max_workers=FLOW_PROCESSING_THREADS,
+            thread_name_prefix="timeline_flow_processor",
+        )
 
     def convert_timestamp_to_slips_format(self, timestamp: float) -> str:
-        if self.is_human_timestamp:
-            timestamp = utils.convert_format(timestamp, utils.alerts_format)
-        return str(timestamp)
+        if not self.is_human_timestamp:
+            return str(timestamp)
+
+        try:
+            # most flows have unix timestamps, convert them directly
+            # instead of detecting their format first
+            datetime_obj = datetime.fromtimestamp(
+                float(timestamp), tz=utils.local_tz
+            )
+        except (ValueError, TypeError, OverflowError):
+            return str(utils.convert_format(timestamp, utils.alerts_format))
+        return datetime_obj.strftime(self.human_timestamp_format)
 
     def validate_bytes(self, bytes: Any) -> int:
         if not isinstance(bytes, int):
@@ -42,14 +131,13 @@ class Timeline(IModule):
 
     def is_inbound_traffic(self, profileid, daddr) -> bool:
         """return True if profileid's IP is the same as the daddr"""
-        profile_ip = profileid.split("_")[1]
-        return self.analysis_direction == "all" and str(daddr) == str(
-            profile_ip
-        )
+        if self.analysis_direction != "all":
+            return False
+        return daddr == profileid.rpartition("_")[2]
 
     def process_dns_altflow(self, alt_flow: dict):
         answer = alt_flow["answers"]
-        if "NXDOMAIN" in alt_flow["rcode_name"]:
+        if alt_flow["rcode_name"] == "NXDOMAIN":
             answer = "NXDOMAIN"
         dns_activity = {
             "query": alt_flow["query"],
@@ -117,27 +205,26 @@ class Timeline(IModule):
             "login": success,
             "auth_attempts": alt_flow["auth_attempts"],
             "client": alt_flow["client"],
-            "server": alt_flow["client"],
+            "server": alt_flow["server"],
         }
+        # auth_attempts=0 is meaningful, so only drop the empty strings
+        ssh_activity = {k: v for k, v in ssh_activity.items() if v != ""}
         return {"info": ssh_activity}
 
-    def process_altflow(self, profileid, twid, uid) -> dict:
-        alt_flow: dict = self.db.get_altflow_from_uid(profileid, twid, uid)
+    def process_altflow(self, alt_flow: dict) -> dict:
         altflow_info = {"info": ""}
 
         if not alt_flow:
             return altflow_info
 
-        flow_type = alt_flow["type_"]
-        flow_type_map = {
-            "dns": self.process_dns_altflow,
-            "http": self.process_http_altflow,
-            "ssl": self.process_ssl_altflow,
-            "ssh": self.process_ssh_altflow,
-        }
+        handler = self.altflow_handlers.get(alt_flow.get("type_"))
+        if handler is None:
+            return altflow_info
+
         try:
-            altflow_info = flow_type_map[flow_type](alt_flow)
+            altflow_info = getattr(self, handler)(alt_flow)
         except KeyError:
+            # altflow missing one of the fields its handler reads
             pass
         return altflow_info
 
@@ -145,6 +232,31 @@ class Timeline(IModule):
         """
         returns a list or a str with the dns resolution of the given ip
         """
+        now = time.monotonic()
+        try:
+            expiry, dns_resolution = self.dns_resolutions[ip]
+            if expiry > now:
+                return dns_resolution
+        except KeyError:
+            pass
+
+        dns_resolution = self.get_dns_resolution_from_db(ip)
+        if dns_resolution != "????":
+            # unresolved ips aren't cached, their resolution may be
+            # stored in the db any moment
+            if len(self.dns_resolutions) >= CACHE_SIZE:
+                self.dns_resolutions.clear()
+            self.dns_resolutions[ip] = (
+                now + DNS_RESOLUTION_CACHE_TTL,
+                dns_resolution,
+            )
+        return dns_resolution
+
+    def get_dns_resolution_from_db(self, ip):
+        """
+        returns a list or a str with the dns resolution of the given ip
+        as stored in the db
+        """
         dns_resolution: dict = self.db.get_dns_resolution(ip)
         dns_resolution: list = dns_resolution.get("domains", [])
 
@@ -160,7 +272,7 @@ class Timeline(IModule):
     def process_tcp_udp_flow(
         self, profileid: str, dport_name: str, flow: dict
     ):
-        dur = round(float(flow["dur"]), 3)
+        dur = get_duration(flow)
         daddr = flow["daddr"]
         state = flow["state"]
         stime = flow["ts"]
@@ -185,7 +297,7 @@ class Timeline(IModule):
             ),
             "dns_resolution": self.get_dns_resolution(daddr),
             "daddr": daddr,
-            "dport/proto": f"{str(dport)}/{proto}",
+            "dport/proto": f"{dport}/{proto}",
             "state": state,
             "warning": "No data exchange!" if not allbytes else "",
             "info": "",
@@ -203,37 +315,24 @@ class Timeline(IModule):
         stime = flow["ts"]
         saddr = flow["saddr"]
         daddr = flow["daddr"]
-        dur = round(float(flow["dur"]), 3)
+        dur = get_duration(flow)
         allbytes = self.validate_bytes(flow["allbytes"])
         timestamp_human = self.convert_timestamp_to_slips_format(stime)
 
-        extra_info = {}
+        icmp_type = None
         warning = ""
 
         # Zeek format
         if isinstance(sport, int):
-            icmp_types = {
-                11: "ICMP Time Exceeded in Transit",
-                3: "ICMP Destination Net Unreachable",
-                8: "PING echo",
-            }
             try:
-                dport_name = icmp_types[sport]
+                dport_name = ZEEK_ICMP_TYPES[sport]
             except KeyError:
                 dport_name = "ICMP Unknown type"
-                extra_info["type"] = f"0x{str(sport)}"
+                icmp_type = f"0x{sport}"
 
         # Argus format
         elif isinstance(sport, str):
-            icmp_types_str = {
-                "0x0008": "PING echo",
-                "0x0103": "ICMP Host Unreachable",
-                "0x0303": "ICMP Port Unreachable",
-                "0x000b": "",
-                "0x0003": "ICMP Destination Net Unreachable",
-            }
-
-            dport_name = icmp_types_str.get(sport, "ICMP Unknown type")
+            dport_name = ARGUS_ICMP_TYPES.get(sport, "ICMP Unknown type")
 
             if sport == "0x0303":
                 warning = f"Unreachable port is {int(dport, 16)}"
@@ -245,27 +344,23 @@ class Timeline(IModule):
             "saddr": saddr,
             "size": allbytes,
             "duration": dur,
+            "dns_resolution": "",
+            "daddr": daddr,
+            "dport/proto": f"{sport}/ICMP",
+            "state": "",
+            "warning": warning,
+            "sent": "",
+            "recv": "",
+            "tot": "",
+            "critical warning": "",
         }
-
-        extra_info.update(
-            {
-                "dns_resolution": "",
-                "daddr": daddr,
-                "dport/proto": f"{sport}/ICMP",
-                "state": "",
-                "warning": warning,
-                "sent": "",
-                "recv": "",
-                "tot": "",
-                "critical warning": "",
-            }
-        )
-        activity.update(extra_info)
+        if icmp_type:
+            activity["type"] = icmp_type
         return activity
 
     def process_igmp_flow(self, profileid: str, dport_name: str, flow: dict):
         stime = flow["ts"]
-        dur = round(float(flow["dur"]), 3)
+        dur = get_duration(flow)
         saddr = flow["daddr"]
         allbytes = self.validate_bytes(flow["allbytes"])
         timestamp_human = self.convert_timestamp_to_slips_format(stime)
@@ -278,6 +373,17 @@ class Timeline(IModule):
             "duration": dur,
         }
 
+    def get_port_info(self, portproto: str) -> Optional[str]:
+        """
+        returns the name of the given port/proto. the ports info is
+        loaded to the db when slips starts, so it's read once per port
+        """
+        if portproto not in self.ports_info:
+            if len(self.ports_info) >= CACHE_SIZE:
+                self.ports_info.clear()
+            self.ports_info[portproto] = self.db.get_port_info(portproto)
+        return self.ports_info[portproto]
+
     def interpret_dport(self, flow) -> str:
         """tries to get a meaningful name of the dport used
         in the given flow"""
@@ -286,18 +392,18 @@ class Timeline(IModule):
         if not dport_name or dport_name == "failed":
             dport = flow["dport"]
             proto = flow["proto"]
-            dport_name = self.db.get_port_info(f"{dport}/{proto.lower()}")
+            dport_name = self.get_port_info(f"{dport}/{proto.lower()}")
         dport_name = "" if not dport_name else dport_name.upper()
         return dport_name
 
-    def process_flow(self, profileid, twid, flow, timestamp: float):
+    def process_flow(self, profileid, flow: dict) -> Optional[dict]:
         """
-        Process the received flow  for this profileid and twid
+        Process the received flow  for this profileid
          so its printed by the logprocess later
+        returns the activity of the flow, the activity of
+        its altflow is added later by add_timeline_lines()
         """
         try:
-            uid = next(iter(flow))
-            flow: dict = json.loads(flow[uid])
             proto = flow["proto"].upper()
             dport_name = self.interpret_dport(flow)
             # interpret the given flow and and create an activity line to
@@ -306,29 +412,10 @@ class Timeline(IModule):
             # flows for external IP, i.e direction 'all' and destination IP
             # == profile IP.
             # If not changed, it would have printed  'IP1 https asked to IP1'.
-            proto_handlers = {
-                "TCP": self.process_tcp_udp_flow,
-                "UDP": self.process_tcp_udp_flow,
-                "ICMP": self.process_icmp_flow,
-                "IPV6-ICMP": self.process_icmp_flow,
-                "IPV4-ICMP": self.process_icmp_flow,
-                "IGMP": self.process_igmp_flow,
-            }
-            if proto in proto_handlers:
-                activity = proto_handlers[proto](profileid, dport_name, flow)
-            else:
-                activity = {}
-            #################################
-            # Now process the alternative flows
-            # Sometimes we need to wait a little to give time to Zeek to find
-            # the related flow since they are read very fast together.
-            # This should be improved algorithmically probably
-            time.sleep(0.05)
-            alt_activity = self.process_altflow(profileid, twid, uid)
-            # Combine the activity of normal flows and activity of alternative
-            # flows and store in the DB for this profileid and twid
-            activity.update(alt_activity)
-            self.db.add_timeline_line(profileid, twid, activity, timestamp)
+            if proto not in self.proto_handlers:
+                return {}
+            handler = getattr(self, self.proto_handlers[proto])
+            return handler(profileid, dport_name, flow)
 
         except Exception:
             exception_line = sys.exc_info()[2].tb_lineno
@@ -336,19 +423,110 @@ class Timeline(IModule):
                 f"Problem on process_flow() line {exception_line}", 0, 1
             )
             self.print(traceback.format_exc(), 0, 1)
-            return True
+
+    def add_timeline_lines(self, flows: List[tuple], wait=True):
+        """
+        Gets the alternative flows of all the given flows with one query,
+        combines the activity of each flow with the activity of its
+        altflow and stores them all in the DB in one batch
+        :param flows: (profileid, twid, uid, activity, timestamp) tuples
+        :param wait: if True, flows that don't have an altflow yet are
+        queued in self.pending_altflows instead of being added without it
+        """
+        try:
+            alt_flows: Dict[str, dict] = self.db.get_altflows_from_uids(
+                [flow[2] for flow in flows]
+            )
+            deadline = time.monotonic() + ALTFLOW_WAIT_TIME
+            lines = []
+            for profileid, twid, uid, activity, timestamp in flows:
+                if wait and uid not in alt_flows:
+                    # Sometimes we need to wait a little to give time to
+                    # Zeek to find the related flow since they are read
+                    # very fast together. check again later instead of
+                    # blocking here
+                    self.pending_altflows.append(
+                        (deadline, profileid, twid, uid, activity, timestamp)
+                    )
+                    continue
+
+                activity.update(self.process_altflow(alt_flows.get(uid)))
+                lines.append((profileid, twid, activity, timestamp))
+
+            self.db.add_timeline_lines(lines)
+        except Exception:
+            exception_line = sys.exc_info()[2].tb_lineno
+            self.print(
+                f"Problem on add_timeline_lines() line {exception_line}",
+                0,
+                1,
+            )
+            self.print(traceback.format_exc(), 0, 1)
+
+    def process_pending_altflows(self, wait=True):
+        """
+        adds the flows that were waiting for their altflow to the timeline,
+        with or without their altflow
+        :param wait: if True, only the flows that waited
+        ALTFLOW_WAIT_TIME are processed
+        """
+        now = time.monotonic()
+        flows = []
+        while self.pending_altflows:
+            if wait and self.pending_altflows[0][0] > now:
+                break
+            flows.append(self.pending_altflows.popleft()[1:])
+
+        if flows:
+            self.add_timeline_lines(flows, wait=False)
+
+    def get_idle_wait_time(self) -> float:
+        """
+        returns how long to wait for a new flow without delaying the
+        flows that are waiting for their altflows
+        """
+        if not self.pending_altflows:
+            return MAX_IDLE_WAIT_TIME
+        deadline = self.pending_altflows[0][0]
+        return min(max(deadline - time.monotonic(), 0), MAX_IDLE_WAIT_TIME)
+
+    def shutdown_gracefully(self):
+        self.process_pending_altflows(wait=False)
+        self.flow_processors.shutdown()
 
     def pre_main(self):
         utils.drop_root_privs()
 
     def main(self):
         # Main loop function
-        if msg := self.get_msg("new_flow"):
-            mdata = msg["data"]
-            mdata = json.loads(mdata)
-            profileid = mdata["profileid"]
-            twid = mdata["twid"]
-            flow = mdata["flow"]
-            timestamp = mdata["stime"]
-            flow = json.loads(flow)
-            self.process_flow(profileid, twid, flow, timestamp)
+        self.process_pending_altflows()
+        # handle all the flows that are waiting in the channel, up to
+        # MAX_FLOWS_PER_BATCH, so that their altflows are read together
+        msgs = []
+        while len(msgs) < MAX_FLOWS_PER_BATCH:
+            # block until the first flow arrives instead of polling,
+            # then drain the rest without waiting
+            timeout = None if msgs else self.get_idle_wait_time()
+            msg = self.get_msg("new_flow", timeout=timeout)
+            if not msg:
+                break
+            # the msg and the flow in it are decoded together, once
+            msgs.append(utils.parse_new_flow_msg(msg["data"]))
+
+        if not msgs:
+            return
+
+        # the activities are created in parallel, map() returns them in
+        # the same order as the msgs
+        activities = self.flow_processors.map(
+            self.process_flow,
+            [mdata["profileid"] for mdata, _, _ in msgs],
+            [flow for _, _, flow in msgs],
+        )
+        flows = [
+            (mdata["profileid"], mdata["twid"], uid, activity, mdata["stime"])
+            for (mdata, uid, _), activity in zip(msgs, activities)
+            if activity is not None
+        ]
+        if flows:
+            self.add_timeline_lines(flows)
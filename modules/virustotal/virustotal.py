@@ -595,9 +595,7 @@ class VT(IModule):
             # profileid = data['profileid']
             # twid = data['twid']
             # uid = data['uid']
-            flow_data = json.loads(
-                data["flow"]
-            )  # this is a dict {'uid':json flow data}
+            flow_data: dict = data["flow"]
             domain = flow_data.get("query", False)
 
             cached_data = self.db.get_domain_data(domain)
@@ -170,8 +170,19 @@ class IModule(IObservable, ABC, Process):
         executed once before the main loop
         """
 
-    def get_msg(self, channel: str) -> Optional[dict]:
-        message = self.db.get_message(self.channels[channel])
+    def get_msg(
+        self, channel: str, timeout: Optional[float] = None
+    ) -> Optional[dict]:
+        """
+        :param timeout: seconds to wait for a msg in the given channel.
+        the db's default is used if not given
+        """
+        if timeout is None:
+            message = self.db.get_message(self.channels[channel])
+        else:
+            message = self.db.get_message(
+                self.channels[channel], timeout=timeout
+            )
         if utils.is_msg_intended_for(message, channel):
             self.channel_tracker[channel]["msg_received"] = True
             self.db.incr_msgs_received_in_channel(self.name, channel)
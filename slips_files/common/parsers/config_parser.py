@@ -6,6 +6,9 @@ from slips_files.common.parsers.arg_parser import ArgumentParser
 from slips_files.common.slips_utils import utils
 import yaml
 
+# same as yaml.safe_load(), using libyaml when pyyaml was built with it
+SafeLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
 
 class ConfigParser(object):
     name = "ConfigParser"
@@ -29,7 +32,9 @@ class ConfigParser(object):
         reads slips configuration file, slips.conf/slips.yaml is the default file
         """
         with open(configfile) as source:
-            return yaml.safe_load(source)
+            # the C loader is >10x faster than the pure python one, and
+            # every module parses this file when it starts
+            return yaml.load(source, Loader=SafeLoader)
 
     def get_config_file(self):
         """
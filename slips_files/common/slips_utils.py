@@ -13,7 +13,7 @@ import os
 import sys
 import ipaddress
 import aid_hash
-from typing import Any, Optional
+from typing import Any, Optional, Tuple
 from dataclasses import is_dataclass, asdict
 from enum import Enum
 
@@ -68,6 +68,8 @@ class Utils(object):
         self.alerts_format = "%Y/%m/%d %H:%M:%S.%f%z"
         self.local_tz = self.get_local_timezone()
         self.aid = aid_hash.AID()
+        # the last msg decoded by parse_new_flow_msg() and its result
+        self.last_new_flow_msg: Tuple[str, tuple] = ("", ())
 
     def extract_hostname(self, url: str) -> str:
         """
@@ -396,6 +398,26 @@ class Utils(object):
             and message["channel"] == channel
         )
 
+    def parse_new_flow_msg(self, data: str) -> Tuple[dict, str, dict]:
+        """
+        decodes the json data of a msg sent in the new_flow channel
+        returns a tuple with the msg dict, the uid of the flow and
+        the flow dict.
+        the last decoded msg is cached because the same msg is usually
+        handled by more than one analyzer of the same module, so the
+        returned dicts shouldn't be modified
+        """
+        last_data, parsed_msg = self.last_new_flow_msg
+        if data == last_data:
+            return parsed_msg
+
+        new_flow = json.loads(data)
+        flow: dict = json.loads(new_flow["flow"])
+        uid = next(iter(flow))
+        parsed_msg = (new_flow, uid, json.loads(flow[uid]))
+        self.last_new_flow_msg = (data, parsed_msg)
+        return parsed_msg
+
     def change_logfiles_ownership(self, file: str, UID, GID):
         """
         if slips is running in docker, the owner of the alerts log files is always root
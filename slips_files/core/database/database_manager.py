@@ -272,6 +272,9 @@ class DBManager(IObservable):
     def get_domain_resolution(self, *args, **kwargs):
         return self.rdb.get_domain_resolution(*args, **kwargs)
 
+    def get_domains_resolutions(self, *args, **kwargs):
+        return self.rdb.get_domains_resolutions(*args, **kwargs)
+
     def get_all_dns_resolutions(self, *args, **kwargs):
         return self.rdb.get_all_dns_resolutions(*args, **kwargs)
 
@@ -591,6 +594,9 @@ class DBManager(IObservable):
     def get_altflow_from_uid(self, *args, **kwargs):
         return self.sqlite.get_altflow_from_uid(*args, **kwargs)
 
+    def get_altflows_from_uids(self, *args, **kwargs):
+        return self.sqlite.get_altflows_from_uids(*args, **kwargs)
+
     def get_all_flows_in_profileid_twid(self, *args, **kwargs):
         return self.sqlite.get_all_flows_in_profileid_twid(*args, **kwargs)
 
@@ -767,6 +773,9 @@ class DBManager(IObservable):
     def add_timeline_line(self, *args, **kwargs):
         return self.rdb.add_timeline_line(*args, **kwargs)
 
+    def add_timeline_lines(self, *args, **kwargs):
+        return self.rdb.add_timeline_lines(*args, **kwargs)
+
     def get_timeline_last_lines(self, *args, **kwargs):
         return self.rdb.get_timeline_last_lines(*args, **kwargs)
 
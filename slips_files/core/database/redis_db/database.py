@@ -715,11 +715,17 @@ class RedisDB(IoCHandler, AlertHandler, ProfileHandler, IObservable):
             return ip_info
         return {}
 
-    def is_ip_resolved(self, ip, hrs):
+    def is_ip_resolved(self, ip, hrs, dns_resolution: Optional[dict] = None):
         """
         :param hrs: float, how many hours to look back for resolutions
+        :param dns_resolution: the output of get_dns_resolution(ip), pass
+        it if you already have it to avoid querying the db again
         """
-        ip_info = self.get_dns_resolution(ip)
+        ip_info = (
+            self.get_dns_resolution(ip)
+            if dns_resolution is None
+            else dns_resolution
+        )
         if ip_info == {}:
             return False
 
@@ -1137,6 +1143,18 @@ class RedisDB(IoCHandler, AlertHandler, ProfileHandler, IObservable):
         ips = self.r.hget("DomainsResolved", domain)
         return json.loads(ips) if ips else []
 
+    def get_domains_resolutions(self, domains: List[str]) -> List[str]:
+        """
+        Returns the IPs resolved by all the given domains, in one query
+        """
+        if not domains:
+            return []
+        ips = []
+        for resolution in self.r.hmget("DomainsResolved", domains):
+            if resolution:
+                ips.extend(json.loads(resolution))
+        return ips
+
     def get_all_dns_resolutions(self):
         dns_resolutions = self.r.hgetall("DNSresolution")
         return dns_resolutions or []
@@ -242,8 +242,9 @@ class ProfileHandler(IObservable):
             "stime": flow.starttime,
         }
 
-        dns_flow = json.dumps(dns_flow)
         # TODO we should just send the DNS obj!
+        # the flow is sent as a dict inside the msg, not as a json str, so
+        # subscribers decode it with the msg in one json.loads()
         to_send = {
             "profileid": profileid,
             "twid": twid,
@@ -1802,6 +1803,32 @@ class ProfileHandler(IObservable):
         # Mark the tw as modified since the timeline line is new data in the TW
         self.mark_profile_tw_as_modified(profileid, twid, timestamp="")
 
+    def add_timeline_lines(self, lines: List[Tuple[str, str, dict, float]]):
+        """
+        Add many lines to the timelines of their profileids and twids
+        using one redis round trip
+        :param lines: (profileid, twid, data, timestamp) tuples
+        """
+        timelines = {}
+        for profileid, twid, data, timestamp in lines:
+            self.print(
+                f"Adding timeline for {profileid}, {twid}: {data}", 3, 0
+            )
+            timelines.setdefault((profileid, twid), {})[
+                json.dumps(data)
+            ] = timestamp
+        if not timelines:
+            return
+
+        pipe = self.r.pipeline(transaction=False)
+        for (profileid, twid), mapping in timelines.items():
+            key = f"{profileid}{self.separator}{twid}{self.separator}timeline"
+            pipe.zadd(key, mapping)
+        pipe.execute()
+
+        for profileid, twid in timelines:
+            self.mark_profile_tw_as_modified(profileid, twid, timestamp="")
+
     def get_timeline_last_lines(
         self, profileid, twid, first_index: int
     ) -> Tuple[str, int]:
@@ -117,6 +117,21 @@ class SQLiteDB(IObservable):
             return json.loads(flow)
         return False
 
+    def get_altflows_from_uids(self, uids: List[str]) -> Dict[str, dict]:
+        """
+        Given a list of uids, get the alternative flows associated with
+        them using one query
+        returns {uid: altflow} for the uids that have an altflow
+        """
+        if not uids:
+            return {}
+        placeholders = ", ".join("?" * len(uids))
+        self.execute(
+            f"SELECT uid, flow FROM altflows WHERE uid IN ({placeholders})",
+            uids,
+        )
+        return {uid: json.loads(flow) for uid, flow in self.fetchall()}
+
     def get_all_contacted_ips_in_profileid_twid(self, profileid, twid) -> dict:
         all_flows: dict = self.get_all_flows_in_profileid_twid(profileid, twid)
 
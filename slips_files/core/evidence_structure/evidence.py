@@ -3,7 +3,8 @@ Contains evidence dataclass that is used in slips
 """
 
 import ipaddress
-from dataclasses import dataclass, field, asdict, is_dataclass
+from dataclasses import dataclass, field, fields, is_dataclass
+from datetime import datetime
 from enum import Enum, auto
 from uuid import uuid4
 from typing import List, Optional
@@ -20,9 +21,12 @@ def validate_timestamp(ts) -> str:
     the ts of all evidence should be in
      the alerts time format, if not, raise an exception
     """
-    if utils.get_time_format(ts) == utils.alerts_format:
+    # parse with the alerts format only instead of trying every format
+    # utils.get_time_format() knows
+    try:
+        datetime.strptime(ts, utils.alerts_format)
         return ts
-    else:
+    except (ValueError, TypeError):
         raise ValueError(
             f"Invalid timestamp format: {ts}. "
             f"Expected format: '%Y/%m/%d %H:%M:%S.%f%z'."
@@ -176,7 +180,7 @@ class Proto(Enum):
     ICMP = "icmp"
 
 
-@dataclass
+@dataclass(slots=True)
 class Victim:
     direction: Direction
     victim_type: IoCType
@@ -205,20 +209,20 @@ class IDEACategory(Enum):
     INTRUSION_BOTNET = "Intrusion.Botnet"
 
 
-@dataclass
+@dataclass(slots=True)
 class ProfileID:
     ip: str
 
     def __setattr__(self, name, value):
         if name == "ip":
             assert ipaddress.ip_address(value)
-        self.__dict__[name] = value
+        object.__setattr__(self, name, value)
 
     def __repr__(self):
         return f"profile_{self.ip}"
 
 
-@dataclass
+@dataclass(slots=True)
 class Attacker:
     direction: Direction
     attacker_type: IoCType
@@ -233,7 +237,7 @@ class Attacker:
             self.profile = ProfileID(ip=self.value)
 
 
-@dataclass
+@dataclass(slots=True)
 class TimeWindow:
     number: int
 
@@ -248,7 +252,7 @@ class TimeWindow:
         return f"timewindow{self.number}"
 
 
-@dataclass
+@dataclass(slots=True)
 class Evidence:
     evidence_type: EvidenceType
     description: str
@@ -285,8 +289,8 @@ class Evidence:
         ):
             raise ValueError(f"uid must be a list of strings .. {self}")
         else:
-            # remove duplicate uids
-            self.uid = list(set(self.uid))
+            # remove duplicate uids, keeping the order they were seen in
+            self.uid = list(dict.fromkeys(self.uid))
 
 
 def evidence_to_dict(obj):
@@ -295,8 +299,12 @@ def evidence_to_dict(obj):
     :param obj: object of any type.
     """
     if is_dataclass(obj):
-        # run this function on each value of the given dataclass
-        return {k: evidence_to_dict(v) for k, v in asdict(obj).items()}
+        # run this function on each field of the given dataclass.
+        # asdict() isn't used because it deepcopies every value before
+        # we convert it anyway
+        return {
+            f.name: evidence_to_dict(getattr(obj, f.name)) for f in fields(obj)
+        }
 
     if isinstance(obj, Enum):
         return obj.name
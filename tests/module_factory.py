@@ -1,4 +1,5 @@
 import shutil
+from functools import lru_cache
 from unittest.mock import (
     patch,
     Mock,
@@ -9,12 +10,10 @@ import os
 
 from modules.flowalerts.conn import Conn
 from slips_files.core.database.database_manager import DBManager
+from slips_files.core.database.sqlite_db.database import SQLiteDB
 
-from slips_files.core.helpers.notify import Notify
 from modules.flowalerts.dns import DNS
-from multiprocessing.connection import Connection
 from modules.flowalerts.downloaded_file import DownloadedFile
-from modules.progress_bar.progress_bar import PBar
 from modules.flowalerts.notice import Notice
 from modules.flowalerts.smtp import SMTP
 from modules.flowalerts.software import Software
@@ -23,7 +22,6 @@ from modules.flowalerts.ssl import SSL
 from modules.flowalerts.tunnel import Tunnel
 from modules.p2ptrust.trust.trustdb import TrustDB
 from modules.p2ptrust.utils.go_director import GoDirector
-from slips.main import Main
 from modules.update_manager.update_manager import UpdateManager
 from modules.leak_detector.leak_detector import LeakDetector
 from slips_files.core.profiler import Profiler
@@ -35,7 +33,6 @@ from modules.flowalerts.set_evidence import SetEvidnceHelper
 from slips_files.core.input import Input
 from modules.blocking.blocking import Blocking
 from modules.http_analyzer.http_analyzer import HTTPAnalyzer
-from modules.ip_info.ip_info import IPInfo
 from slips_files.common.slips_utils import utils
 from slips_files.core.helpers.whitelist.whitelist import Whitelist
 from tests.common_test_utils import do_nothing
@@ -43,7 +40,7 @@ from modules.virustotal.virustotal import VT
 from managers.process_manager import ProcessManager
 from managers.redis_manager import RedisManager
 from modules.ip_info.asn_info import ASN
-from multiprocessing import Queue, Event
+from multiprocessing import Queue
 from slips_files.core.helpers.flow_handler import FlowHandler
 from slips_files.core.helpers.symbols_handler import SymbolHandler
 from modules.network_discovery.horizontal_portscan import HorizontalPortscan
@@ -51,6 +48,7 @@ from modules.network_discovery.network_discovery import NetworkDiscovery
 from modules.network_discovery.vertical_portscan import VerticalPortscan
 from modules.p2ptrust.trust.base_model import BaseModel
 from modules.arp.arp import ARP
+from modules.timeline.timeline import Timeline
 from slips.daemon import Daemon
 from slips_files.core.helpers.checker import Checker
 from modules.cesnet.cesnet import CESNET
@@ -71,9 +69,11 @@ def read_configuration():
     return
 
 
+@lru_cache(maxsize=1)
 def check_zeek_or_bro():
     """
-    Check if we have zeek or bro
+    Check if we have zeek or bro, the result doesn't change while the tests
+    are running
     """
     if shutil.which("zeek"):
         return "zeek"
@@ -89,9 +89,8 @@ DB_MANAGER = "slips_files.core.database.database_manager.DBManager"
 
 class ModuleFactory:
     def __init__(self):
-        self.profiler_queue = Queue()
-        self.input_queue = Queue()
         self.logger = Mock()
+        self._flowalerts = None
 
     def get_default_db(self):
         """default is o port 6379, this is the one we're using in conftest"""
@@ -122,11 +121,14 @@ class ModuleFactory:
             )
         db.r = db.rdb.r
         db.print = Mock()
-        assert db.get_used_redis_port() == port
         return db
 
     def create_main_obj(self):
         """returns an instance of Main() class in slips.py"""
+        # imported here because it's the slowest import in this file and
+        # most tests don't need it
+        from slips.main import Main
+
         main = Main(testing=True)
         main.input_information = ""
         main.input_type = "pcap"
@@ -172,6 +174,17 @@ class ModuleFactory:
         arp.print = Mock()
         return arp
 
+    @patch(MODULE_DB_MANAGER, name="mock_db")
+    def create_timeline_object(self, mock_db):
+        timeline = Timeline(
+            self.logger,
+            "dummy_output_dir",
+            6379,
+            Mock(),
+        )
+        timeline.print = Mock()
+        return timeline
+
     @patch(MODULE_DB_MANAGER, name="mock_db")
     def create_blocking_obj(self, mock_db):
         blocking = Blocking(
@@ -197,24 +210,37 @@ class ModuleFactory:
         flowalerts.print = Mock()
         return flowalerts
 
+    def get_flowalerts_for_analyzers(self):
+        """
+        returns the FlowAlerts obj shared by the analyzers created by this
+        factory. its init() isn't called because the analyzers only need
+        its db and whitelist, not the other analyzers it creates
+        """
+        if self._flowalerts is None:
+            with patch.object(FlowAlerts, "init"):
+                flowalerts = self.create_flowalerts_obj()
+            flowalerts.whitelist = Whitelist(flowalerts.logger, flowalerts.db)
+            self._flowalerts = flowalerts
+        return self._flowalerts
+
     @patch(DB_MANAGER, name="mock_db")
     def create_dns_analyzer_obj(self, mock_db):
-        flowalerts = self.create_flowalerts_obj()
+        flowalerts = self.get_flowalerts_for_analyzers()
         return DNS(flowalerts.db, flowalerts=flowalerts)
 
     @patch(DB_MANAGER, name="mock_db")
     def create_notice_analyzer_obj(self, mock_db):
-        flowalerts = self.create_flowalerts_obj()
+        flowalerts = self.get_flowalerts_for_analyzers()
         return Notice(flowalerts.db, flowalerts=flowalerts)
 
     @patch(DB_MANAGER, name="mock_db")
     def create_smtp_analyzer_obj(self, mock_db):
-        flowalerts = self.create_flowalerts_obj()
+        flowalerts = self.get_flowalerts_for_analyzers()
         return SMTP(flowalerts.db, flowalerts=flowalerts)
 
     @patch(DB_MANAGER, name="mock_db")
     def create_ssl_analyzer_obj(self, mock_db):
-        flowalerts = self.create_flowalerts_obj()
+        flowalerts = self.get_flowalerts_for_analyzers()
         with patch(
             "modules.flowalerts.ssl.SSL"
             ".wait_for_ssl_flows_to_appear_in_connlog",
@@ -225,27 +251,27 @@ class ModuleFactory:
 
     @patch(DB_MANAGER, name="mock_db")
     def create_ssh_analyzer_obj(self, mock_db):
-        flowalerts = self.create_flowalerts_obj()
+        flowalerts = self.get_flowalerts_for_analyzers()
         return SSH(flowalerts.db, flowalerts=flowalerts)
 
     @patch(DB_MANAGER, name="mock_db")
     def create_downloaded_file_analyzer_obj(self, mock_db):
-        flowalerts = self.create_flowalerts_obj()
+        flowalerts = self.get_flowalerts_for_analyzers()
         return DownloadedFile(flowalerts.db, flowalerts=flowalerts)
 
     @patch(DB_MANAGER, name="mock_db")
     def create_tunnel_analyzer_obj(self, mock_db):
-        flowalerts = self.create_flowalerts_obj()
+        flowalerts = self.get_flowalerts_for_analyzers()
         return Tunnel(flowalerts.db, flowalerts=flowalerts)
 
     @patch(DB_MANAGER, name="mock_db")
     def create_conn_analyzer_obj(self, mock_db):
-        flowalerts = self.create_flowalerts_obj()
+        flowalerts = self.get_flowalerts_for_analyzers()
         return Conn(flowalerts.db, flowalerts=flowalerts)
 
     @patch(DB_MANAGER, name="mock_db")
     def create_software_analyzer_obj(self, mock_db):
-        flowalerts = self.create_flowalerts_obj()
+        flowalerts = self.get_flowalerts_for_analyzers()
         return Software(flowalerts.db, flowalerts=flowalerts)
 
     @patch(CORE_DB_MANAGER, name="mock_db")
@@ -254,11 +280,11 @@ class ModuleFactory:
     ):
         zeek_tmp_dir = os.path.join(os.getcwd(), "zeek_dir_for_testing")
         input = Input(
-            Output(),
+            self.logger,
             "dummy_output_dir",
             6379,
             is_input_done=Mock(),
-            profiler_queue=self.profiler_queue,
+            profiler_queue=Queue(),
             input_type=input_type,
             input_information=input_information,
             cli_packet_filter=None,
@@ -279,6 +305,8 @@ class ModuleFactory:
 
     @patch(MODULE_DB_MANAGER, name="mock_db")
     def create_ip_info_obj(self, mock_db):
+        from modules.ip_info.ip_info import IPInfo
+
         ip_info = IPInfo(
             self.logger,
             "dummy_output_dir",
@@ -322,7 +350,7 @@ class ModuleFactory:
             6379,
             Mock(),
             is_profiler_done=Mock(),
-            profiler_queue=self.input_queue,
+            profiler_queue=Queue(),
             is_profiler_done_event=Mock(),
         )
         # override the self.print function to avoid broken pipes
@@ -520,8 +548,8 @@ class ModuleFactory:
 
     @patch(MODULE_DB_MANAGER, name="mock_db")
     def create_progress_bar_obj(self, mock_db):
-        mock_pipe = Mock(spec=Connection)
-        mock_pbar_finished = Mock(spec=Event)
+        from modules.progress_bar.progress_bar import PBar
+
         pbar = PBar(
             self.logger,
             "dummy_output_dir",
@@ -529,9 +557,9 @@ class ModuleFactory:
             Mock(),
         )
         pbar.init(
-            pipe=mock_pipe,
+            pipe=Mock(),
             slips_mode="normal",
-            pbar_finished=mock_pbar_finished,
+            pbar_finished=Mock(),
         )
         pbar.print = Mock()
 
@@ -555,6 +583,11 @@ class ModuleFactory:
         daemon.daemon_stop_lock = "slips_daemon_stop"
         return daemon
 
+    def create_sqlite_db_obj(self, output_dir):
+        sqlite = SQLiteDB(self.logger, output_dir)
+        sqlite.print = Mock()
+        return sqlite
+
     @patch("sqlite3.connect", name="sqlite_mock")
     def create_trust_db_obj(self, sqlite_mock):
         trust_db = TrustDB(self.logger, Mock(), drop_tables_on_startup=False)
@@ -568,6 +601,8 @@ class ModuleFactory:
         return BaseModel(logger, trustdb)
 
     def create_notify_obj(self):
+        from slips_files.core.helpers.notify import Notify
+
         notify = Notify()
         return notify
 
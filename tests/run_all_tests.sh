@@ -6,7 +6,8 @@ printf "0" | ./slips.py -k
 
 # run all unit tests, -n *5 means distribute tests on 5 different process
 # -s to see print statements as they are executed
-python3  -m pytest tests/ --ignore="tests/test_database.py" --ignore="tests/integration_tests" -n 7 -p no:warnings -vvvv -s
+# --dist loadgroup keeps tests marked with the same xdist_group on one worker
+python3  -m pytest tests/ --ignore="tests/test_database.py" --ignore="tests/integration_tests" -n 7 --dist loadgroup -p no:warnings -vvvv -s
 
 ## run db tests serially/using 1 worker
 python3  -m pytest tests/test_database.py -p no:warnings -vvvv -s
@@ -1,7 +1,14 @@
 """Unit test for modules/flowalerts/conn.py"""
 
 from tests.module_factory import ModuleFactory
+from modules.flowalerts.conn import (
+    is_multicast,
+    is_multicast_link_local_or_reserved,
+    is_ipv4,
+    port_to_int,
+)
 import json
+import threading
 from unittest.mock import Mock
 import pytest
 from ipaddress import ip_address
@@ -186,6 +193,60 @@ def test_check_multiple_reconnection_attempts(
     assert mock_set_evidence.call_count == expected_calls
 
 
+def test_reconnections_are_saved_when_the_tw_closes():
+    conn = ModuleFactory().create_conn_analyzer_obj()
+    conn.db.get_reconnections_for_tw.return_value = {}
+    for uid in ("uid1", "uid2"):
+        conn.check_multiple_reconnection_attempts(
+            "REJ",
+            "192.168.1.1",
+            "192.168.1.2",
+            "80",
+            uid,
+            profileid,
+            twid,
+            timestamp,
+        )
+    conn.db.get_reconnections_for_tw.assert_called_once()
+    conn.db.setReconnections.assert_not_called()
+
+    conn.forget_reconnections(profileid, twid)
+
+    conn.db.setReconnections.assert_called_once_with(
+        profileid,
+        twid,
+        {"192.168.1.1-192.168.1.2-80": [2, ["uid1", "uid2"]]},
+    )
+    assert conn.reconnections == {}
+    assert conn.unsaved_reconnections == set()
+
+
+@pytest.mark.parametrize(
+    "data, expected_profileid, expected_twid",
+    [
+        (
+            "profile_192.168.1.1_timewindow1",
+            "profile_192.168.1.1",
+            "timewindow1",
+        ),
+        (
+            "profile_2001:db8::1_timewindow20",
+            "profile_2001:db8::1",
+            "timewindow20",
+        ),
+    ],
+)
+def test_analyze_tw_closed(mocker, data, expected_profileid, expected_twid):
+    conn = ModuleFactory().create_conn_analyzer_obj()
+    detect_data_upload = mocker.patch.object(
+        conn, "detect_data_upload_in_twid"
+    )
+    conn.analyze({"channel": "tw_closed", "data": data})
+    detect_data_upload.assert_called_once_with(
+        expected_profileid, expected_twid
+    )
+
+
 @pytest.mark.parametrize(
     "ip_address, expected_result",
     [  # Testcase1:Gateway
@@ -243,8 +304,20 @@ def test_is_ignored_ip_data_upload(ip_address, expected_result):
 )
 def test_get_sent_bytes(all_flows, expected_bytes_sent):
     conn = ModuleFactory().create_conn_analyzer_obj()
-    bytes_sent = conn.get_sent_bytes(all_flows)
+    conn.flow_upload_threshold = float("inf")
+    for uid, flow in all_flows.items():
+        conn.check_data_upload(
+            flow.get("sbytes", 0),
+            flow["daddr"],
+            uid,
+            profileid,
+            twid,
+            flow["starttime"],
+        )
+    bytes_sent = conn.get_sent_bytes(profileid, twid)
     assert bytes_sent == expected_bytes_sent
+    # the tw is forgotten once its sent bytes are read
+    assert conn.get_sent_bytes(profileid, twid) == {}
 
 
 @pytest.mark.parametrize(
@@ -279,6 +352,26 @@ def test_check_data_upload(
     assert mock_set_evidence.call_count == expected_call_count
 
 
+def test_shutdown_gracefully_detects_data_upload_in_unclosed_tws(mocker):
+    conn = ModuleFactory().create_conn_analyzer_obj()
+    mock_set_evidence = mocker.patch(
+        "modules.flowalerts.set_evidence." "SetEvidnceHelper.data_exfiltration"
+    )
+    conn.data_exfiltration_threshold = 100
+    # the tw is never closed, slips stops before that
+    for uid_ in ("uid1", "uid2"):
+        conn.add_sent_bytes(
+            60 * 10**6, "8.8.8.8", uid_, profileid, twid, timestamp
+        )
+
+    conn.shutdown_gracefully()
+
+    mock_set_evidence.assert_called_once_with(
+        "8.8.8.8", 120, profileid, twid, ["uid1", "uid2"], timestamp
+    )
+    assert not conn.bytes_sent
+
+
 @pytest.mark.parametrize(
     "flow_type, appproto, daddr, input_type, "
     "is_doh_server, is_dns_server, "
@@ -314,7 +407,7 @@ def test_should_ignore_conn_without_dns(
     """Tests the should_ignore_conn_without_dns
     function with various scenarios."""
     conn = ModuleFactory().create_conn_analyzer_obj()
-    conn.db.get_input_type.return_value = input_type
+    conn.input_type = input_type
     conn.db.is_doh_server.return_value = is_doh_server
     conn.dns_analyzer = Mock()
     conn.dns_analyzer.is_dns_server = Mock(return_value=is_dns_server)
@@ -443,6 +536,60 @@ def test_check_conn_to_port_0(
     assert mock_set_evidence.call_count == expected_calls
 
 
+@pytest.mark.parametrize(
+    "saddr, daddr, ips_data, expected_calls",
+    [
+        (  # Testcase 1: profile connected to 2 ports of the daddr
+            "192.168.1.1",
+            "192.168.1.2",
+            {"192.168.1.2": {"dstports": {"5555": 1, "6666": 1}, "uid": []}},
+            1,
+        ),
+        (  # Testcase 2: profile connected to 1 port of the daddr
+            "192.168.1.1",
+            "192.168.1.2",
+            {"192.168.1.2": {"dstports": {"5555": 1}, "uid": []}},
+            0,
+        ),
+        (  # Testcase 3: saddr connected to 2 ports of the profile
+            "192.168.1.2",
+            "192.168.1.1",
+            {"192.168.1.2": {"dstports": {"5555": 1, "6666": 1}, "uid": []}},
+            1,
+        ),
+        (  # Testcase 4: no established conns from the saddr in the db
+            "192.168.1.2",
+            "192.168.1.1",
+            {},
+            0,
+        ),
+    ],
+)
+def test_detect_connection_to_multiple_ports(
+    mocker, saddr, daddr, ips_data, expected_calls
+):
+    conn = ModuleFactory().create_conn_analyzer_obj()
+    mock_set_evidence = mocker.patch.object(
+        conn.set_evidence, "connection_to_multiple_ports"
+    )
+    conn.db.get_port_info.return_value = None
+    conn.db.get_data_from_profile_tw.return_value = ips_data
+
+    conn.detect_connection_to_multiple_ports(
+        saddr,
+        daddr,
+        "tcp",
+        "Established",
+        "",
+        6666,
+        timestamp,
+        profileid,
+        "192.168.1.1",
+        twid,
+    )
+    assert mock_set_evidence.call_count == expected_calls
+
+
 @pytest.mark.parametrize(
     "state, daddr, dport, proto," " appproto, allbytes, expected_calls",
     [
@@ -681,6 +828,20 @@ def test_port_belongs_to_an_org(
     )
 
 
+def test_is_ip_in_org_is_cached(mocker):
+    conn = ModuleFactory().create_conn_analyzer_obj()
+    is_ip_in_org = mocker.patch.object(
+        conn.whitelist.org_analyzer, "is_ip_in_org", return_value=None
+    )
+    for _ in range(3):
+        assert conn.is_ip_in_org("157.240.3.35", "facebook") is False
+    is_ip_in_org.assert_called_once_with("157.240.3.35", "facebook")
+
+    is_ip_in_org.return_value = True
+    assert conn.is_ip_in_org("157.240.3.35", "google") is True
+    assert is_ip_in_org.call_count == 2
+
+
 @pytest.mark.parametrize(
     "flow_type, smac, old_ip_list, saddr, expected_calls",
     [
@@ -737,25 +898,38 @@ def test_check_device_changing_ips(
     conn.db.get_ip_of_mac.return_value = old_ip_list
 
     conn.check_device_changing_ips(
-        flow_type, smac, f"profile_{saddr}", twid, uid, timestamp
+        flow_type, smac, f"profile_{saddr}", saddr, twid, uid, timestamp
     )
     assert mock_set_evidence.call_count == expected_calls
 
 
+def mock_org_info(org, info_type):
+    """returns dummy org info the same way db.get_org_info() does"""
+    org_info = {
+        ("google", "domains"): ["google.com"],
+        ("facebook", "domains"): ["facebook.com"],
+        ("microsoft", "asn"): ["AS8075"],
+    }
+    return json.dumps(org_info.get((org, info_type), []))
+
+
+def mock_org_ips(org):
+    """returns dummy org ranges the same way db.get_org_IPs() does"""
+    if org == "microsoft":
+        return {"204": ["204.79.197.0/24"]}
+    return {}
+
+
 @pytest.mark.parametrize(
-    "ip, ip_info, is_ip_asn_in_org_asn, "
-    "is_domain_in_org, is_ip_in_org, expected_result",
+    "ip, ip_info, expected_result",
     [
         # Test case 1: Well-known org by SNI
         (
             "8.8.8.8",
             {
                 "SNI": {"server_name": "google.com"},
-                "reverse_dns": "dns.google",
+                "reverse_dns": "dns.example",
             },
-            False,
-            True,
-            False,
             True,
         ),
         # Test case 2: Well-known org by reverse DNS
@@ -765,27 +939,18 @@ def test_check_device_changing_ips(
                 "SNI": None,
                 "reverse_dns": "edge-star-mini-shv-01-amt2.facebook.com",
             },
-            False,
-            True,
-            False,
             True,
         ),
         # Test case 3: Well-known org by ASN
         (
             "13.107.42.14",
-            {"SNI": None, "reverse_dns": None},
-            True,
-            False,
-            False,
+            {"SNI": None, "reverse_dns": None, "asn": {"number": "AS8075"}},
             True,
         ),
         # Test case 4: Well-known org by IP range
         (
             "204.79.197.200",
             {"SNI": None, "reverse_dns": None},
-            False,
-            False,
-            True,
             True,
         ),
         # Test case 5: Not a well-known org
@@ -793,41 +958,56 @@ def test_check_device_changing_ips(
             "203.0.113.1",
             {"SNI": None, "reverse_dns": None},
             False,
-            False,
-            False,
-            False,
         ),
     ],
 )
-def test_is_well_known_org(
-    mocker,
-    ip,
-    ip_info,
-    is_ip_asn_in_org_asn,
-    is_domain_in_org,
-    is_ip_in_org,
-    expected_result,
-):
+def test_is_well_known_org(ip, ip_info, expected_result):
     conn = ModuleFactory().create_conn_analyzer_obj()
     conn.db.get_ip_info.return_value = ip_info
-    mock_is_ip_asn_in_org_asn = mocker.patch(
-        "slips_files.core.helpers.whitelist.organization_whitelist."
-        "OrgAnalyzer.is_ip_asn_in_org_asn"
-    )
-    mock_is_ip_asn_in_org_asn.return_value = is_ip_asn_in_org_asn
+    conn.db.get_org_info.side_effect = mock_org_info
+    conn.db.get_org_IPs.side_effect = mock_org_ips
+    assert conn.is_well_known_org(ip) == expected_result
 
-    mock_is_domain_in_org = mocker.patch(
-        "slips_files.core.helpers.whitelist.organization_whitelist."
-        "OrgAnalyzer.is_domain_in_org"
-    )
-    mock_is_domain_in_org.return_value = is_domain_in_org
 
-    mock_is_ip_in_org = mocker.patch(
-        "slips_files.core.helpers.whitelist."
-        "organization_whitelist.OrgAnalyzer.is_ip_in_org"
-    )
-    mock_is_ip_in_org.return_value = is_ip_in_org
-    assert conn.is_well_known_org(ip) == expected_result
+def test_load_supported_orgs_info():
+    conn = ModuleFactory().create_conn_analyzer_obj()
+    conn.db.get_org_info.return_value = "[]"
+    conn.db.get_org_IPs.return_value = {}
+    # the org info isn't in the db yet
+    conn.load_supported_orgs_info()
+    assert not conn.supported_orgs_info_loaded
+
+    conn.db.get_org_info.side_effect = mock_org_info
+    conn.db.get_org_IPs.side_effect = mock_org_ips
+    conn.load_supported_orgs_info()
+    assert conn.supported_orgs_info_loaded
+    assert conn.supported_orgs_asns == {"AS8075"}
+    assert conn.supported_orgs_domains == {
+        "com": ["google.com", "facebook.com"]
+    }
+
+
+@pytest.mark.parametrize(
+    "domain, expected_result",
+    [
+        # Test case 1: org domain
+        ("google.com", True),
+        # Test case 2: subdomain of an org domain
+        ("www.facebook.com", True),
+        # Test case 3: part of an org domain
+        ("book.com", True),
+        # Test case 4: same tld, different domain
+        ("example.com", False),
+        # Test case 5: no org domains with this tld
+        ("google.net", False),
+    ],
+)
+def test_is_domain_in_supported_orgs(domain, expected_result):
+    conn = ModuleFactory().create_conn_analyzer_obj()
+    conn.db.get_org_info.side_effect = mock_org_info
+    conn.db.get_org_IPs.side_effect = mock_org_ips
+    conn.load_supported_orgs_info()
+    assert conn.is_domain_in_supported_orgs(domain) is expected_result
 
 
 @pytest.mark.parametrize(
@@ -935,9 +1115,259 @@ def test_check_connection_to_local_ip(
     mock_set_evidence = mocker.patch.object(
         conn.set_evidence, "conn_to_private_ip"
     )
-    conn.db.get_gateway_ip.return_value = "192.168.1.1"
+    conn.gateway = "192.168.1.1"
 
     conn.check_connection_to_local_ip(
         daddr, dport, proto, saddr, twid, uid, timestamp
     )
     assert mock_set_evidence.call_count == expected_calls
+
+
+@pytest.mark.parametrize(
+    "local_network, expected_localnet",
+    [
+        # Test case 1: local network isn't set in the db yet
+        (None, None),
+        # Test case 2: /24 local network
+        ("192.168.1.0/24", (3232235776, 4294967040)),
+        # Test case 3: /8 local network
+        ("10.0.0.0/8", (167772160, 4278190080)),
+    ],
+)
+def test_get_localnet(local_network, expected_localnet):
+    conn = ModuleFactory().create_conn_analyzer_obj()
+    conn.db.get_local_network.return_value = local_network
+
+    assert conn.get_localnet() == expected_localnet
+    # the localnet should only be read from the db once it's set
+    conn.get_localnet()
+    expected_db_calls = 1 if local_network else 2
+    assert conn.db.get_local_network.call_count == expected_db_calls
+
+
+@pytest.mark.parametrize(
+    "ip, org_ips, expected_result",
+    [
+        # Test case 1: ip belongs to a range
+        ("192.168.1.2", ["192.168.1.0/24"], True),
+        # Test case 2: ip is outside all ranges
+        ("192.168.2.2", ["192.168.1.0/24", "10.0.0.0/8"], False),
+        # Test case 3: overlapping ranges are merged
+        ("10.1.2.3", ["10.1.0.0/16", "10.0.0.0/8", "10.1.2.0/24"], True),
+        # Test case 4: malformed ranges are skipped
+        ("172.16.0.5", ["", "not_an_ip", "172.16.0.0/12"], True),
+        # Test case 5: ipv6 ip and range
+        ("2001:db8::1", ["2001:db8::/32", "192.168.1.0/24"], True),
+        # Test case 6: invalid ip
+        ("invalid", ["192.168.1.0/24"], False),
+    ],
+)
+def test_is_ip_in_org_ranges(ip, org_ips, expected_result):
+    conn = ModuleFactory().create_conn_analyzer_obj()
+    assert conn.is_ip_in_org_ranges(ip, "80/tcp", org_ips) is expected_result
+
+
+def test_is_well_known_org_caches_positive_results(mocker):
+    conn = ModuleFactory().create_conn_analyzer_obj()
+    conn.db.get_ip_info.return_value = {"SNI": None, "reverse_dns": None}
+    mock_is_in_supported_orgs = mocker.patch.object(
+        conn, "is_in_supported_orgs", return_value=True
+    )
+
+    assert conn.is_well_known_org("8.8.8.8")
+    assert conn.is_well_known_org("8.8.8.8")
+    mock_is_in_supported_orgs.assert_called_once()
+    assert conn.db.get_ip_info.call_count == 1
+
+    mock_is_in_supported_orgs.return_value = False
+    assert not conn.is_well_known_org("1.2.3.4")
+    assert not conn.is_well_known_org("1.2.3.4")
+    assert mock_is_in_supported_orgs.call_count == 3
+
+
+@pytest.mark.parametrize(
+    "gateway_at_init, gateway_in_db, expected_gateway, expected_db_calls",
+    [
+        # Test case 1: gateway was known when the analyzer started
+        ("192.168.1.1", "192.168.1.1", "192.168.1.1", 0),
+        # Test case 2: gateway was set in the db after the analyzer started
+        (None, "192.168.1.1", "192.168.1.1", 1),
+        # Test case 3: gateway is still unknown
+        (None, None, None, 2),
+    ],
+)
+def test_get_gateway(
+    gateway_at_init, gateway_in_db, expected_gateway, expected_db_calls
+):
+    conn = ModuleFactory().create_conn_analyzer_obj()
+    conn.gateway = gateway_at_init
+    conn.db.get_gateway_ip.reset_mock()
+    conn.db.get_gateway_ip.return_value = gateway_in_db
+
+    assert conn.get_gateway() == expected_gateway
+    assert conn.get_gateway() == expected_gateway
+    assert conn.db.get_gateway_ip.call_count == expected_db_calls
+
+
+def test_is_doh_server_caches_positive_results():
+    conn = ModuleFactory().create_conn_analyzer_obj()
+    conn.db.is_doh_server.return_value = False
+    assert not conn.is_doh_server("1.1.1.1")
+
+    conn.db.is_doh_server.return_value = True
+    assert conn.is_doh_server("1.1.1.1")
+    assert conn.is_doh_server("1.1.1.1")
+    assert conn.db.is_doh_server.call_count == 2
+
+
+@pytest.mark.parametrize(
+    "ip",
+    [
+        "8.8.8.8",
+        "192.168.1.1",
+        "223.255.255.255",
+        "224.0.0.1",
+        "239.255.255.250",
+        "240.0.0.0",
+        "255.255.255.255",
+        "169.254.1.1",
+        "169.253.255.255",
+        "169.255.0.0",
+        "0.0.0.0",
+        "ff02::1",
+        "fe80::1",
+        "2001:4860:4860::8888",
+    ],
+)
+def test_ip_classification_matches_ipaddress(ip):
+    ip_obj = ip_address(ip)
+    assert is_multicast(ip_obj) == ip_obj.is_multicast
+    assert is_multicast_link_local_or_reserved(ip_obj) == (
+        ip_obj.is_multicast or ip_obj.is_link_local or ip_obj.is_reserved
+    )
+
+
+@pytest.mark.parametrize(
+    "ip, expected_result",
+    [
+        ("192.168.1.1", True),
+        ("0.0.0.0", True),
+        ("255.255.255.255", True),
+        ("256.1.1.1", False),
+        ("192.168.1", False),
+        ("192.168.1.1.1", False),
+        ("01.2.3.4", False),
+        # non-ascii digits
+        ("\u0661.2.3.4", False),
+        ("1.2.3.\u0664", False),
+        ("fe80::1", False),
+        ("", False),
+        (None, False),
+    ],
+)
+def test_is_ipv4(ip, expected_result):
+    assert is_ipv4(ip) is expected_result
+
+
+@pytest.mark.parametrize(
+    "port, expected_port",
+    [
+        ("80", 80),
+        (443, 443),
+        # arp flows have no ports
+        ("", ""),
+        (None, None),
+        # icmp types in argus flows
+        ("0x0008", "0x0008"),
+    ],
+)
+def test_port_to_int(port, expected_port):
+    assert port_to_int(port) == expected_port
+
+
+def test_check_connection_without_dns_resolution_after_timer(mocker):
+    conn = ModuleFactory().create_conn_analyzer_obj()
+    mocker.patch.object(
+        conn, "should_ignore_conn_without_dns", return_value=False
+    )
+    mocker.patch.object(conn, "is_well_known_org", return_value=False)
+    mock_set_evidence = mocker.patch.object(
+        conn.set_evidence, "conn_without_dns"
+    )
+    conn.is_running_non_stop = False
+    conn.db.get_dns_resolution.return_value = {}
+    conn.db.is_ip_resolved.return_value = False
+    conn.db.get_the_other_ip_version.return_value = json.dumps("fe80::1")
+    # the timer thread already waited for the resolution of this conn
+    conn.connections_checked_in_conn_dns_timer_thread.add(uid)
+
+    conn.check_connection_without_dns_resolution(
+        "conn", "http", "8.8.8.8", twid, profileid, saddr, timestamp, uid
+    )
+
+    mock_set_evidence.assert_called_once()
+    conn.db.get_dns_resolution.assert_called_once_with("8.8.8.8")
+    assert uid not in conn.connections_checked_in_conn_dns_timer_thread
+
+
+def test_conn_without_dns_timer_runs_tasks_in_order():
+    conn = ModuleFactory().create_conn_analyzer_obj()
+    done = threading.Event()
+    ran = []
+
+    def task(name):
+        ran.append(name)
+        if len(ran) == 3:
+            done.set()
+
+    conn.conn_without_dns_timer.schedule(0.2, task, ["third"])
+    conn.conn_without_dns_timer.schedule(0.1, task, ["second"])
+    conn.conn_without_dns_timer.schedule(0, task, ["first"])
+
+    assert done.wait(timeout=5)
+    assert ran == ["first", "second", "third"]
+    conn.shutdown_gracefully()
+    assert not conn.conn_without_dns_timer.is_alive()
+
+
+def test_conn_without_dns_timer_runs_pending_tasks_on_shutdown():
+    conn = ModuleFactory().create_conn_analyzer_obj()
+    ran = []
+
+    conn.conn_without_dns_timer.schedule(60, ran.append, ["later"])
+    conn.conn_without_dns_timer.schedule(30, ran.append, ["sooner"])
+    conn.shutdown_gracefully()
+
+    assert ran == ["sooner", "later"]
+    assert not conn.conn_without_dns_timer.is_alive()
+
+
+def test_conn_without_dns_timer_slow_task_doesnt_delay_others():
+    conn = ModuleFactory().create_conn_analyzer_obj()
+    release = threading.Event()
+    fast_task_done = threading.Event()
+
+    conn.conn_without_dns_timer.schedule(0, release.wait, [5])
+    conn.conn_without_dns_timer.schedule(0.05, fast_task_done.set, [])
+
+    # the fast task runs while the slow one is still waiting
+    assert fast_task_done.wait(timeout=2)
+    release.set()
+    conn.shutdown_gracefully()
+
+
+def test_conn_without_dns_timer_logs_failing_tasks():
+    conn = ModuleFactory().create_conn_analyzer_obj()
+    conn.conn_without_dns_timer.print = Mock()
+    ran = []
+
+    def failing_task():
+        raise ValueError("failed")
+
+    conn.conn_without_dns_timer.schedule(0, failing_task, [])
+    conn.conn_without_dns_timer.schedule(0, ran.append, ["next"])
+    conn.shutdown_gracefully()
+
+    assert ran == ["next"]
+    traceback = conn.conn_without_dns_timer.print.call_args_list[-1][0][0]
+    assert "ValueError: failed" in traceback
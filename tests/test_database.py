@@ -1,10 +1,9 @@
+import dataclasses
 import redis
 import json
-import time
 import pytest
 
 from slips_files.common.slips_utils import utils
-from slips_files.core.flows.zeek import Conn
 from tests.module_factory import ModuleFactory
 from slips_files.core.evidence_structure.evidence import (
     Evidence,
@@ -24,25 +23,6 @@ from slips_files.core.evidence_structure.evidence import (
 profileid = "profile_192.168.1.1"
 twid = "timewindow1"
 test_ip = "192.168.1.1"
-flow = Conn(
-    "1601998398.945854",
-    "1234",
-    test_ip,
-    "8.8.8.8",
-    5,
-    "TCP",
-    "dhcp",
-    80,
-    88,
-    20,
-    20,
-    20,
-    20,
-    "",
-    "",
-    "Established",
-    "",
-)
 
 
 def test_getProfileIdFromIP():
@@ -55,6 +35,11 @@ def test_getProfileIdFromIP():
     assert db.get_profileid_from_ip(test_ip) is not False
 
 
+def test_get_used_redis_port():
+    db = ModuleFactory().create_db_manager_obj(6379, flush_db=True)
+    assert db.get_used_redis_port() == 6379
+
+
 def test_timewindows():
     """unit tests for addNewTW , getLastTWforProfile and
     getFirstTWforProfile"""
@@ -70,7 +55,7 @@ def test_timewindows():
     assert db.get_last_twid_of_profile(profileid) == ("timewindow2", 3700.0)
 
 
-def test_add_ips():
+def test_add_ips(flow):
     db = ModuleFactory().create_db_manager_obj(6379, flush_db=True)
     # add a profile
     db.add_profile(profileid, "00:00", "1")
@@ -82,15 +67,15 @@ def test_add_ips():
     assert stored_src_ips == '{"192.168.1.1": 1}'
 
 
-def test_add_port():
+def test_add_port(flow):
     db = ModuleFactory().create_db_manager_obj(6379, flush_db=True)
-    new_flow = flow
-    new_flow.state = "Not Established"
+    flow = dataclasses.replace(flow, state="Not Established")
     db.add_port(profileid, twid, flow, "Server", "Dst")
-    hash_key = f"{profileid}_{twid}"
-    added_ports = db.r.hgetall(hash_key)
-    assert "DstPortsServerTCPNot Established" in added_ports.keys()
-    assert flow.daddr in added_ports["DstPortsServerTCPNot Established"]
+    added_ports = db.r.hget(
+        f"{profileid}_{twid}", "DstPortsServerTCPNot Established"
+    )
+    assert added_ports is not None
+    assert flow.daddr in added_ports
 
 
 def test_set_evidence():
@@ -101,7 +86,7 @@ def test_set_evidence():
     threat_level: ThreatLevel = ThreatLevel.INFO
     confidence = 0.8
     description = f"SSH Successful to IP : 8.8.8.8 . From IP {test_ip}"
-    timestamp = time.time()
+    timestamp = 1601998398.945854
     uid = ["123"]
     victim: Victim = Victim(
         direction=Direction.DST, victim_type=IoCType.IP, value="8.8.8.8"
@@ -177,15 +162,20 @@ def test_add_mac_addr_to_profile():
     ipv6 = "2001:0db8:85a3:0000:0000:8a2e:0370:7334"
     profileid_ipv6 = f"profile_{ipv6}"
     db.add_mac_addr_to_profile(profileid_ipv6, mac_addr)
+    pipe = db.r.pipeline()
+    pipe.hget("MAC", mac_addr)
+    pipe.hget(profileid_ipv6, "IPv4")
+    pipe.hget(profileid_ipv4, "IPv6")
+    mac_ips, ipv6_profile_ipv4, ipv4_profile_ipv6 = pipe.execute()
     # make sure the mac is associated with his ipv6
-    assert ipv6 in db.r.hget("MAC", mac_addr)
+    assert ipv6 in mac_ips
     # make sure the ipv4 is associated with this
     # ipv6 profile
-    assert ipv4 in str(db.r.hmget(profileid_ipv6, "IPv4"))
+    assert ipv4 in str(ipv6_profile_ipv4)
 
     # make sure the ipv6 is associated with the
     # profile that has the same ipv4 as the mac
-    assert ipv6 in str(db.r.hmget(profileid_ipv4, "IPv6"))
+    assert ipv6 in str(ipv4_profile_ipv6)
 
 
 def test_get_the_other_ip_version():
@@ -240,3 +230,61 @@ def test_update_max_threat_level(
     assert (
         db.update_max_threat_level(profileid, cur_threat_level) == expected_max
     )
+
+
+def test_add_timeline_lines():
+    db = ModuleFactory().create_db_manager_obj(6379, flush_db=True)
+    lines = [
+        (profileid, "timewindow1", {"info": "first"}, 1.0),
+        (profileid, "timewindow2", {"info": "second"}, 2.0),
+        (profileid, "timewindow1", {"info": "third"}, 3.0),
+    ]
+    db.add_timeline_lines(lines)
+
+    timeline, last_index = db.get_timeline_last_lines(
+        profileid, "timewindow1", 0
+    )
+    assert last_index == 2
+    assert [json.loads(line) for line in timeline] == [
+        {"info": "first"},
+        {"info": "third"},
+    ]
+    timeline, last_index = db.get_timeline_last_lines(
+        profileid, "timewindow2", 0
+    )
+    assert [json.loads(line) for line in timeline] == [{"info": "second"}]
+    # each tw is marked as modified once
+    assert db.r.zcard("ModifiedTW") == 2
+
+
+def test_add_timeline_lines_with_no_lines():
+    db = ModuleFactory().create_db_manager_obj(6379, flush_db=True)
+    db.add_timeline_lines([])
+    assert db.r.zcard("ModifiedTW") == 0
+
+
+@pytest.mark.parametrize(
+    "domains, expected_ips",
+    [
+        # Testcase1: no domains
+        ([], []),
+        # Testcase2: all domains have resolutions
+        (
+            ["google.com", "example.com"],
+            ["142.250.1.1", "142.250.1.2", "93.184.216.34"],
+        ),
+        # Testcase3: some domains were never resolved
+        (["unknown.com", "example.com", "other.com"], ["93.184.216.34"]),
+        # Testcase4: none of the domains were resolved
+        (["unknown.com"], []),
+    ],
+)
+def test_get_domains_resolutions(domains, expected_ips):
+    db = ModuleFactory().create_db_manager_obj(6379, flush_db=True)
+    db.r.hset(
+        "DomainsResolved",
+        "google.com",
+        json.dumps(["142.250.1.1", "142.250.1.2"]),
+    )
+    db.r.hset("DomainsResolved", "example.com", json.dumps(["93.184.216.34"]))
+    assert db.get_domains_resolutions(domains) == expected_ips
@@ -5,6 +5,8 @@ from numpy import arange
 from unittest.mock import patch, Mock
 import pytest
 import json
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 # dummy params used for testing
 profileid = "profile_192.168.1.1"
@@ -41,30 +43,37 @@ def test_should_detect_dns_without_conn(domain, rcode_name, expected_result):
         (
             ["192.168.1.1", "google.com"],
             ["192.168.1.2"],
-            ["192.168.1.1", "192.168.1.2"],
+            {"192.168.1.1": "uid1", "192.168.1.2": "uid2"},
             True,
         ),
         # Testcase2: CNAME does not resolve to a contacted IP
         (
             ["192.168.1.1", "google.com"],
             ["10.0.0.1"],
-            ["192.168.1.1", "192.168.1.2"],
+            {"192.168.1.1": "uid1", "192.168.1.2": "uid2"},
             False,
         ),
         # Testcase3: No CNAMEs in answers
         (
             ["192.168.1.1", "192.168.1.3"],
             [],
-            ["192.168.1.1", "192.168.1.2"],
+            {"192.168.1.1": "uid1", "192.168.1.2": "uid2"},
             False,
         ),
+        # Testcase4: the second CNAME resolves to a contacted IP
+        (
+            ["google.com", "example.com"],
+            ["10.0.0.1", "192.168.1.2"],
+            {"192.168.1.1": "uid1", "192.168.1.2": "uid2"},
+            True,
+        ),
     ],
 )
 def test_is_cname_contacted(
     answers, cname_resolution, contacted_ips, expected_result
 ):
     dns = ModuleFactory().create_dns_analyzer_obj()
-    dns.db.get_domain_resolution.return_value = cname_resolution
+    dns.db.get_domains_resolutions.return_value = cname_resolution
 
     assert dns.is_cname_contacted(answers, contacted_ips) is expected_result
 
@@ -122,6 +131,24 @@ def test_detect_young_domains_other_cases(
     dns.db.get_domain_data.assert_called_once_with(domain)
 
 
+def test_get_domain_age_is_cached():
+    dns = ModuleFactory().create_dns_analyzer_obj()
+    dns.db.get_domain_data.return_value = {"Age": 10}
+
+    assert dns.get_domain_age("example.com") == 10
+    assert dns.get_domain_age("example.com") == 10
+    dns.db.get_domain_data.assert_called_once_with("example.com")
+
+
+def test_get_domain_age_missing_age_isnt_cached():
+    dns = ModuleFactory().create_dns_analyzer_obj()
+    dns.db.get_domain_data.side_effect = [{}, {"Age": 10}]
+
+    assert dns.get_domain_age("example.com") is None
+    assert dns.get_domain_age("example.com") == 10
+    assert dns.db.get_domain_data.call_count == 2
+
+
 def test_extract_ips_from_dns_answers():
     dns = ModuleFactory().create_dns_analyzer_obj()
     answers = [
@@ -129,32 +156,44 @@ def test_extract_ips_from_dns_answers():
         "2001:db8::1",
         "CNAME_example.com",
         "MX=mail.example.com",
+        "999.168.1.1",
+        "::ffff:10.0.0.1",
+        "2001:db8:::1",
+        "TXT v=spf1 include:_spf.example.com ~all",
+        "-",
     ]
     extracted_ips = dns.extract_ips_from_dns_answers(answers)
-    assert extracted_ips == ["192.168.1.1", "2001:db8::1"]
+    assert extracted_ips == ["192.168.1.1", "2001:db8::1", "::ffff:10.0.0.1"]
 
 
 @pytest.mark.parametrize(
-    "contacted_ips, other_ip, expected_result",
+    "contacted_ips, other_ip, ips, expected_result",
     [  # Testcase1: Connection exists from other IP version
-        (["8.8.8.8"], ["192.168.1.2"], True),
+        ({"8.8.8.8": "uid1"}, ["192.168.1.2"], ["8.8.8.8"], True),
         # Testcase2: No connection from other IP version
-        (["1.1.1.1"], ["192.168.1.2"], None),
+        ({"1.1.1.1": "uid1"}, ["192.168.1.2"], ["8.8.8.8"], False),
         # Testcase3: No contacted IPs from other IP version
-        ([], ["192.168.1.2"], False),
+        ({}, ["192.168.1.2"], ["8.8.8.8"], False),
         # Testcase4: No other IP version found
-        (["8.8.8.8"], [], False),
+        ({"8.8.8.8": "uid1"}, [], ["8.8.8.8"], False),
+        # Testcase5: one of many answers was contacted
+        (
+            {"8.8.4.4": "uid1"},
+            ["192.168.1.2"],
+            ["8.8.8.8", "8.8.4.4"],
+            True,
+        ),
     ],
 )
 def test_is_connection_made_by_different_version(
-    mocker, contacted_ips, other_ip, expected_result
+    contacted_ips, other_ip, ips, expected_result
 ):
     dns = ModuleFactory().create_dns_analyzer_obj()
     dns.db.get_all_contacted_ips_in_profileid_twid.return_value = contacted_ips
     dns.db.get_the_other_ip_version.return_value = other_ip
 
     assert (
-        dns.is_connection_made_by_different_version(profileid, twid, "8.8.8.8")
+        dns.is_connection_made_by_different_version(profileid, twid, ips)
         is expected_result
     )
 
@@ -167,6 +206,8 @@ def test_is_connection_made_by_different_version(
         ("aaaaaaaaaaaaaaaaaaaa", False),
         # Testcase3: String with spaces and special characters
         ("Hello world!", False),
+        # Testcase4: non ascii string
+        ("ñáéíóúüçßøåæœ€£¥©®™", True),
     ],
 )
 def test_estimate_shannon_entropy(string, expected_result):
@@ -177,6 +218,24 @@ def test_estimate_shannon_entropy(string, expected_result):
     assert (entropy >= dns.shannon_entropy_threshold) == expected_result
 
 
+@pytest.mark.parametrize(
+    "string, expected_entropy",
+    [
+        ("", 0),
+        ("aaaa", 0),
+        ("ab", 1),
+        ("abcd", 2),
+        ("aabb", 1),
+        ("ññéé", 1),
+    ],
+)
+def test_estimate_shannon_entropy_value(string, expected_entropy):
+    dns = ModuleFactory().create_dns_analyzer_obj()
+    assert dns.estimate_shannon_entropy(string) == pytest.approx(
+        expected_entropy
+    )
+
+
 @pytest.mark.parametrize(
     "domain, answers, " "expected_evidence_calls, expected_db_deletes",
     [  # Testcase1:Invalid answer found
@@ -185,6 +244,8 @@ def test_estimate_shannon_entropy(string, expected_result):
         ("example.com", ["8.8.8.8"], 0, 0),
         # Testcase3:Invalid answer for localhost
         ("localhost", ["127.0.0.1"], 0, 0),
+        # Testcase4:Multiple invalid answers
+        ("example.com", ["0.0.0.0", "8.8.8.8", "127.0.0.1"], 2, 2),
     ],
 )
 def test_check_invalid_dns_answers_call_counts(
@@ -248,6 +309,24 @@ def test_check_invalid_dns_answers_with_invalid_answer():
             arange(0, 3, 3 / 10),
             False,
         ),
+        # Testcase 4: slow queries first, then 10 within 2 seconds
+        (
+            [f"{i}example.in-addr.arpa" for i in range(15)],
+            list(range(0, 50, 10)) + list(arange(50, 51, 1 / 10)),
+            True,
+        ),
+        # Testcase 5: the same host queried over and over isn't a scan
+        (
+            ["1.example.in-addr.arpa"] * 10,
+            arange(0, 1, 1 / 10),
+            False,
+        ),
+        # Testcase 6: ipv6 reverse lookups
+        (
+            [f"{i}.example.ip6.arpa" for i in range(10)],
+            arange(0, 1, 1 / 10),
+            True,
+        ),
     ],
 )
 def test_check_dns_arpa_scan(domains, timestamps, expected_result):
@@ -279,6 +358,74 @@ def test_is_dns_server(test_ip, mock_query_side_effect, expected_result):
     assert result == expected_result
 
 
+def test_is_dns_server_probes_once():
+    dns = ModuleFactory().create_dns_analyzer_obj()
+    with patch("dns.query.udp") as mock_query:
+        assert dns.is_dns_server("8.8.8.8")
+        assert dns.is_dns_server("8.8.8.8")
+
+    mock_query.assert_called_once()
+
+
+def test_is_dns_server_probes_again_after_ttl():
+    dns = ModuleFactory().create_dns_analyzer_obj()
+    with (
+        patch("dns.query.udp") as mock_query,
+        patch("time.monotonic", side_effect=[0, 10, 3601]),
+    ):
+        assert dns.is_dns_server("8.8.8.8")
+        assert dns.is_dns_server("8.8.8.8")
+        mock_query.assert_called_once()
+        assert dns.is_dns_server("8.8.8.8")
+
+    assert mock_query.call_count == 2
+
+
+def test_is_dns_server_cache_is_bounded():
+    dns = ModuleFactory().create_dns_analyzer_obj()
+    with (
+        patch("dns.query.udp"),
+        patch("modules.flowalerts.dns.DNS_SERVER_CACHE_SIZE", 2),
+    ):
+        for ip in ("1.1.1.1", "8.8.8.8", "9.9.9.9"):
+            dns.is_dns_server(ip)
+
+    # the oldest probed ip is dropped
+    assert list(dns.dns_servers) == ["8.8.8.8", "9.9.9.9"]
+
+
+def test_is_dns_server_cache_from_many_threads():
+    dns = ModuleFactory().create_dns_analyzer_obj()
+    ips = [f"10.0.0.{i}" for i in range(8)] * 50
+    with (
+        patch("dns.query.udp"),
+        # every cached ip is expired and the cache is always full
+        patch("modules.flowalerts.dns.DNS_SERVER_CACHE_TTL", 0),
+        patch("modules.flowalerts.dns.DNS_SERVER_CACHE_SIZE", 4),
+        ThreadPoolExecutor(8) as pool,
+    ):
+        results = list(pool.map(dns.is_dns_server, ips))
+
+    assert all(results)
+    assert len(dns.dns_servers) <= 4
+
+
+def test_get_domain_age_cache_from_many_threads():
+    dns = ModuleFactory().create_dns_analyzer_obj()
+    dns.db.get_domain_data.return_value = {"Age": 10}
+    domains = [f"example{i}.com" for i in range(8)] * 50
+    with (
+        # every cached age is expired and the cache is always full
+        patch("modules.flowalerts.dns.DOMAIN_AGE_CACHE_TTL", 0),
+        patch("modules.flowalerts.dns.DOMAIN_AGE_CACHE_SIZE", 4),
+        ThreadPoolExecutor(8) as pool,
+    ):
+        ages = list(pool.map(dns.get_domain_age, domains))
+
+    assert ages == [10] * len(domains)
+    assert len(dns.domain_ages) <= 4
+
+
 def test_read_configuration():
     """Test if read_configuration correctly reads the entropy threshold."""
     dns = ModuleFactory().create_dns_analyzer_obj()
@@ -334,9 +481,15 @@ def test_check_high_entropy_dns_answers_with_call():
         # Testcase 2: TXT answer below entropy threshold
         (
             "example.com",
-            ["A 1.2.3.4", "TXT aaaa"],
+            ["A 1.2.3.4", "TXT aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa"],
             2.0,
         ),
+        # Testcase 3: CNAME containing TXT isn't a TXT answer
+        (
+            "example.com",
+            ["myTXTrecords.example.com"],
+            5.0,
+        ),
     ],
 )
 def test_check_high_entropy_dns_answers_no_call(
@@ -353,10 +506,33 @@ def test_check_high_entropy_dns_answers_no_call(
     )
 
     assert dns.set_evidence.suspicious_dns_answer.call_count == 0
-    expected_estimate_calls = sum("TXT" in answer for answer in answers)
+    expected_estimate_calls = sum(
+        answer.startswith("TXT") for answer in answers
+    )
     assert dns.estimate_shannon_entropy.call_count == expected_estimate_calls
 
 
+def test_check_high_entropy_dns_answers_short_answer():
+    dns = ModuleFactory().create_dns_analyzer_obj()
+    dns.shannon_entropy_threshold = 4.0
+    dns.estimate_shannon_entropy = Mock()
+    dns.set_evidence.suspicious_dns_answer = Mock()
+
+    # 15 chars can't have an entropy of 4 or more
+    dns.check_high_entropy_dns_answers(
+        "example.com",
+        ["TXT abcdefghijk"],
+        daddr,
+        profileid,
+        twid,
+        timestamp,
+        uid,
+    )
+
+    dns.estimate_shannon_entropy.assert_not_called()
+    dns.set_evidence.suspicious_dns_answer.assert_not_called()
+
+
 @pytest.mark.parametrize(
     "test_case, expected_calls",
     [
@@ -370,13 +546,11 @@ def test_check_high_entropy_dns_answers_no_call(
                         "uid": uid,
                         "daddr": daddr,
                         "stime": timestamp,
-                        "flow": json.dumps(
-                            {
-                                "query": "example.com",
-                                "answers": ["192.168.1.1"],
-                                "rcode_name": "NOERROR",
-                            }
-                        ),
+                        "flow": {
+                            "query": "example.com",
+                            "answers": ["192.168.1.1"],
+                            "rcode_name": "NOERROR",
+                        },
                     }
                 )
             },
@@ -398,14 +572,40 @@ def test_check_high_entropy_dns_answers_no_call(
                         "twid": twid,
                         "uid": uid,
                         "stime": timestamp,
-                        "flow": json.dumps({"query": "", "answers": []}),
+                        "flow": {"query": "", "answers": []},
                     }
                 )
             },
             {
                 "check_dns_without_connection": 0,
-                "check_high_entropy_dns_answers": 1,
-                "check_invalid_dns_answers": 1,
+                "check_high_entropy_dns_answers": 0,
+                "check_invalid_dns_answers": 0,
+                "detect_dga": 0,
+                "detect_young_domains": 0,
+                "check_dns_arpa_scan": 0,
+            },
+        ),
+        (
+            # Testcase3: NXDOMAIN without answers
+            {
+                "data": json.dumps(
+                    {
+                        "profileid": profileid,
+                        "twid": twid,
+                        "uid": uid,
+                        "stime": timestamp,
+                        "flow": {
+                            "query": "example.com",
+                            "answers": [],
+                            "rcode_name": "NXDOMAIN",
+                        },
+                    }
+                )
+            },
+            {
+                "check_dns_without_connection": 0,
+                "check_high_entropy_dns_answers": 0,
+                "check_invalid_dns_answers": 0,
                 "detect_dga": 1,
                 "detect_young_domains": 1,
                 "check_dns_arpa_scan": 1,
@@ -459,7 +659,7 @@ def test_analyze_new_flow_msg(mocker, test_case, expected_calls):
             "NXDOMAIN",
             "example.com",
             {},
-            {f"{profileid}_{twid}": (["example.com"], [uid])},
+            {f"{profileid}_{twid}": deque([("example.com", uid)])},
             False,
         ),
         # NXDOMAIN, 9th occurrence (below threshold)
@@ -467,38 +667,25 @@ def test_analyze_new_flow_msg(mocker, test_case, expected_calls):
             "NXDOMAIN",
             "example9.com",
             {
-                f"{profileid}_{twid}": (
-                    [
-                        "example1.com",
-                        "example2.com",
-                        "example3.com",
-                        "example4.com",
-                        "example5.com",
-                        "example6.com",
-                        "example7.com",
-                        "example8.com",
-                    ],
-                    [uid] * 8,
+                f"{profileid}_{twid}": deque(
+                    (f"example{i}.com", uid) for i in range(1, 9)
                 )
             },
             {
-                f"{profileid}_{twid}": (
-                    [
-                        "example1.com",
-                        "example2.com",
-                        "example3.com",
-                        "example4.com",
-                        "example5.com",
-                        "example6.com",
-                        "example7.com",
-                        "example8.com",
-                        "example9.com",
-                    ],
-                    [uid] * 9,
+                f"{profileid}_{twid}": deque(
+                    (f"example{i}.com", uid) for i in range(1, 10)
                 )
             },
             None,
         ),
+        # NXDOMAIN, repeated query isn't counted again
+        (
+            "NXDOMAIN",
+            "example1.com",
+            {f"{profileid}_{twid}": deque([("example1.com", uid)])},
+            {f"{profileid}_{twid}": deque([("example1.com", uid)])},
+            False,
+        ),
     ],
 )
 def test_detect_dga_no_alert(
@@ -529,19 +716,8 @@ def test_detect_dga_alert(mocker):
     dns = ModuleFactory().create_dns_analyzer_obj()
 
     initial_nxdomains = {
-        f"{profileid}_{twid}": (
-            [
-                "example1.com",
-                "example2.com",
-                "example3.com",
-                "example4.com",
-                "example5.com",
-                "example6.com",
-                "example7.com",
-                "example8.com",
-                "example9.com",
-            ],
-            [uid] * 9,
+        f"{profileid}_{twid}": deque(
+            (f"example{i}.com", uid) for i in range(1, 10)
         )
     }
     dns.nxdomains = initial_nxdomains
@@ -559,7 +735,7 @@ def test_detect_dga_alert(mocker):
     )
     expected_result = True
     assert result == expected_result
-    assert dns.nxdomains == {f"{profileid}_{twid}": ([], [])}
+    assert dns.nxdomains == {f"{profileid}_{twid}": deque()}
     dns.set_evidence.dga.assert_called_once_with(
         10, timestamp, profileid, twid, [uid] * 10
     )
@@ -585,6 +761,20 @@ def test_detect_dga_whitelisted(mocker):
     dns.set_evidence.dga.assert_not_called()
 
 
+def test_detect_dga_repeated_query_skips_whitelist():
+    dns = ModuleFactory().create_dns_analyzer_obj()
+    dns.nxdomains = {f"{profileid}_{twid}": deque([("example.com", uid)])}
+    dns.nxdomains_threshold = 10
+    dns.flowalerts.whitelist.domain_analyzer.is_whitelisted = Mock()
+
+    result = dns.detect_dga(
+        "NXDOMAIN", "example.com", timestamp, profileid, twid, uid
+    )
+
+    assert result is False
+    dns.flowalerts.whitelist.domain_analyzer.is_whitelisted.assert_not_called()
+
+
 @pytest.mark.parametrize(
     "query, expected_result",
     [  # Testcase1:NXDOMAIN_arpa_domain
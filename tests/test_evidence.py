@@ -1,10 +1,11 @@
+from collections import namedtuple
+
 from tests.module_factory import ModuleFactory
 import pytest
 from slips_files.core.evidence_structure.evidence import validate_timestamp
 from slips_files.core.evidence_structure.evidence import (
     Attacker,
     Direction,
-    Evidence,
     EvidenceType,
     IDEACategory,
     IoCType,
@@ -13,6 +14,7 @@ from slips_files.core.evidence_structure.evidence import (
     Tag,
     ThreatLevel,
     TimeWindow,
+    Victim,
     Anomaly,
     Recon,
     Attempt,
@@ -20,137 +22,180 @@ from slips_files.core.evidence_structure.evidence import (
 )
 
 
-@pytest.mark.parametrize(
+# run all the tests of this file on the same xdist worker (with
+# --dist loadgroup) so they share the module scoped factory below
+pytestmark = pytest.mark.xdist_group(name="evidence")
+
+
+@pytest.fixture(scope="module")
+def factory():
+    """
+    create_evidence_obj() doesn't keep any state, so one ModuleFactory is
+    shared by all the tests in this file
+    """
+    return ModuleFactory()
+
+
+EvidenceSpec = namedtuple(
+    "EvidenceSpec",
     "evidence_type, description, attacker_value, threat_level, "
     "category, profile_ip, timewindow_number, uid, timestamp, "
     "victim_value, proto_value, port, source_target_tag, id, "
     "conn_count, confidence",
-    [  # Testcase1: complete evidence data
-        (
-            EvidenceType.ARP_SCAN,
-            "ARP scan detected",
-            "192.168.1.1",
-            ThreatLevel.LOW,
-            IDEACategory.ANOMALY_TRAFFIC,
-            "192.168.1.2",
-            1,
-            ["flow1", "flow2"],
-            "2023/10/26 10:10:10.000000+0000",
-            "192.168.1.3",
-            "tcp",
-            80,
-            Tag.RECON,
-            "d4afbe1a-1cb9-4db4-9fac-74f2da6f5f34",
-            10,
-            0.8,
-        ),
-        # Testcase2: different evidence type and threat level
-        (
-            EvidenceType.DNS_ARPA_SCAN,
-            "DNS ARPA scan detected",
-            "10.0.0.1",
-            ThreatLevel.MEDIUM,
-            IDEACategory.RECON_SCANNING,
-            "10.0.0.2",
-            2,
-            ["flow3", "flow4", "flow5"],
-            "2023/10/27 11:11:11.000000+0000",
-            "10.0.0.3",
-            "udp",
-            53,
-            Tag.RECON,
-            "d243119b-2aae-4d7a-8ea1-edf3c6e72f4a",
-            5,
-            0.5,
-        ),
-    ],
 )
-def test_evidence_post_init(
-    evidence_type,
-    description,
-    attacker_value,
-    threat_level,
-    category,
-    victim_value,
-    profile_ip,
-    timewindow_number,
-    uid,
-    timestamp,
-    proto_value,
-    port,
-    source_target_tag,
-    id,
-    conn_count,
-    confidence,
-):
-    attacker = ModuleFactory().create_attacker_obj(
-        value=attacker_value, direction=Direction.SRC, attacker_type=IoCType.IP
+
+EVIDENCE_SPECS = [
+    # Testcase1: basic arp scan evidence
+    EvidenceSpec(
+        EvidenceType.ARP_SCAN,
+        "ARP scan detected",
+        "192.168.1.1",
+        ThreatLevel.LOW,
+        IDEACategory.ANOMALY_TRAFFIC,
+        "192.168.1.2",
+        1,
+        ["flow1", "flow2"],
+        "2023/10/26 10:10:10.000000+0000",
+        "192.168.1.3",
+        "tcp",
+        80,
+        Tag.RECON,
+        "d4afbe1a-1cb9-4db4-9fac-74f2da6f5f34",
+        10,
+        0.8,
+    ),
+    # Testcase2: different evidence type and threat level
+    EvidenceSpec(
+        EvidenceType.DNS_ARPA_SCAN,
+        "DNS ARPA scan detected",
+        "10.0.0.1",
+        ThreatLevel.MEDIUM,
+        IDEACategory.RECON_SCANNING,
+        "10.0.0.2",
+        2,
+        ["flow3", "flow4", "flow5"],
+        "2023/10/27 11:11:11.000000+0000",
+        "10.0.0.3",
+        "udp",
+        53,
+        Tag.RECON,
+        "d243119b-2aae-4d7a-8ea1-edf3c6e72f4a",
+        5,
+        0.5,
+    ),
+    # Testcase3: evidence with max values
+    EvidenceSpec(
+        EvidenceType.MALICIOUS_JA3,
+        "Malicious JA3 fingerprint detected",
+        "172.16.0.1",
+        ThreatLevel.CRITICAL,
+        IDEACategory.INTRUSION_BOTNET,
+        "172.16.0.2",
+        100,
+        ["flow6", "flow7", "flow8", "flow9", "flow10"],
+        "2023/10/28 12:12:12.000000+0000",
+        "172.16.0.3",
+        "icmp",
+        0,
+        Tag.MALWARE,
+        "d243119b-2aae-4d7a-8ea1-eef3c6e72f4a",
+        1000,
+        1.0,
+    ),
+]
+EVIDENCE_IDS = ["arp_scan", "dns_arpa_scan", "max_values"]
+
+
+@pytest.fixture
+def evidence(request, factory):
+    """
+    builds the evidence described by the EvidenceSpec in request.param
+    returns the spec and the evidence
+    """
+    spec: EvidenceSpec = request.param
+    evidence = factory.create_evidence_obj(
+        spec.evidence_type,
+        spec.description,
+        Attacker(Direction.SRC, IoCType.IP, spec.attacker_value),
+        spec.threat_level,
+        spec.category,
+        Victim(Direction.DST, IoCType.IP, spec.victim_value),
+        ProfileID(ip=spec.profile_ip),
+        TimeWindow(number=spec.timewindow_number),
+        spec.uid,
+        spec.timestamp,
+        Proto[spec.proto_value.upper()],
+        spec.port,
+        spec.source_target_tag,
+        spec.id,
+        spec.conn_count,
+        spec.confidence,
     )
-    victim = ModuleFactory().create_victim_obj(
-        direction=Direction.DST, victim_type=IoCType.IP, value=victim_value
+    return spec, evidence
+
+
+@pytest.mark.parametrize(
+    "evidence", EVIDENCE_SPECS, ids=EVIDENCE_IDS, indirect=True
+)
+def test_evidence_post_init(evidence):
+    spec, evidence = evidence
+    assert evidence.evidence_type == spec.evidence_type
+    assert evidence.description == spec.description
+    assert evidence.attacker == Attacker(
+        Direction.SRC, IoCType.IP, spec.attacker_value
     )
-    profile = ModuleFactory().create_profileid_obj(ip=profile_ip)
-    timewindow = ModuleFactory().create_timewindow_obj(
-        number=timewindow_number
+    assert evidence.threat_level == spec.threat_level
+    assert evidence.category == spec.category
+    assert evidence.victim == Victim(
+        Direction.DST, IoCType.IP, spec.victim_value
     )
-    proto = ModuleFactory().create_proto_obj()[proto_value.upper()]
-    evidence = ModuleFactory().create_evidence_obj(
-        evidence_type,
-        description,
-        attacker,
-        threat_level,
-        category,
-        victim,
-        profile,
-        timewindow,
-        uid,
-        timestamp,
-        proto,
-        port,
-        source_target_tag,
-        id,
-        conn_count,
-        confidence,
+    assert evidence.profile == ProfileID(ip=spec.profile_ip)
+    assert evidence.timewindow == TimeWindow(number=spec.timewindow_number)
+    assert evidence.uid == spec.uid
+    assert evidence.timestamp == spec.timestamp
+    assert evidence.proto == Proto[spec.proto_value.upper()]
+    assert evidence.port == spec.port
+    assert evidence.source_target_tag == spec.source_target_tag
+    assert evidence.id == spec.id
+    assert evidence.conn_count == spec.conn_count
+    assert evidence.confidence == spec.confidence
+
+
+def test_evidence_post_init_duplicate_uids(factory):
+    evidence = factory.create_evidence_obj(
+        EvidenceType.ARP_SCAN,
+        "ARP scan detected",
+        Attacker(Direction.SRC, IoCType.IP, "192.168.1.1"),
+        ThreatLevel.LOW,
+        IDEACategory.ANOMALY_TRAFFIC,
+        False,
+        ProfileID(ip="192.168.1.1"),
+        TimeWindow(number=1),
+        ["flow3", "flow1", "flow3", "flow2", "flow1"],
+        "2023/10/26 10:10:10.000000+0000",
+        False,
+        None,
+        False,
+        "d4afbe1a-1cb9-4db4-9fac-74f2da6f5f34",
+        1,
+        0.8,
     )
-    assert evidence.evidence_type == evidence_type
-    assert evidence.description == description
-    assert evidence.attacker == attacker
-    assert evidence.threat_level == threat_level
-    assert evidence.category == category
-    assert evidence.victim == victim
-    assert evidence.profile == profile
-    assert evidence.timewindow == timewindow
-    assert set(evidence.uid) == set(uid)
-    assert evidence.timestamp == timestamp
-    assert evidence.proto == proto
-    assert evidence.port == port
-    assert evidence.source_target_tag == source_target_tag
-    assert evidence.id == id
-    assert evidence.conn_count == conn_count
-    assert evidence.confidence == confidence
-
-
-def test_evidence_post_init_invalid_uid():
+    assert evidence.uid == ["flow3", "flow1", "flow2"]
+
+
+def test_evidence_post_init_invalid_uid(factory):
     with pytest.raises(ValueError, match="uid must be a " "list of strings"):
-        ModuleFactory().create_evidence_obj(
+        factory.create_evidence_obj(
             evidence_type=EvidenceType.ARP_SCAN,
             description="ARP scan detected",
-            attacker=ModuleFactory().create_attacker_obj(
-                direction=Direction.SRC,
-                attacker_type=IoCType.IP,
-                value="192.168.1.1",
-            ),
+            attacker=Attacker(Direction.SRC, IoCType.IP, "192.168.1.1"),
             threat_level=ThreatLevel.LOW,
             category=IDEACategory.ANOMALY_TRAFFIC,
-            profile=ModuleFactory().create_profileid_obj(ip="192.168.1.2"),
-            timewindow=ModuleFactory().create_timewindow_obj(number=1),
+            profile=ProfileID(ip="192.168.1.2"),
+            timewindow=TimeWindow(number=1),
             uid=[1, 2, 3],
             timestamp="2023/10/26 10:10:10.000000+0000",
-            victim=ModuleFactory().create_victim_obj(
-                direction=Direction.DST,
-                victim_type=IoCType.IP,
-                value="192.168.1.3",
-            ),
+            victim=Victim(Direction.DST, IoCType.IP, "192.168.1.3"),
             proto=Proto.TCP,
             port=80,
             id=232,
@@ -161,142 +206,64 @@ def test_evidence_post_init_invalid_uid():
 
 
 @pytest.mark.parametrize(
-    "evidence_type, description, attacker_value, "
-    "threat_level, category, profile_ip, timewindow_number, "
-    "uid, timestamp, victim_value, proto_value, port, "
-    "source_target_tag, id, conn_count, confidence",
-    [
-        (
-            # Testcase1 :basic_arp_scan_evidence
-            EvidenceType.ARP_SCAN,
-            "ARP scan detected",
-            "192.168.1.1",
-            ThreatLevel.LOW,
-            IDEACategory.ANOMALY_TRAFFIC,
-            "192.168.1.2",
-            1,
-            ["flow1", "flow2"],
-            "2023/10/26 10:10:10.000000+0000",
-            "192.168.1.3",
-            "tcp",
-            80,
-            Tag.RECON,
-            "d243119b-2aae-4d7a-8ea1-edf3c6e72f4a",
-            10,
-            0.8,
-        ),
-        (
-            # Testcase2 :dns_arpa_scan_evidence
-            EvidenceType.DNS_ARPA_SCAN,
-            "DNS ARPA scan detected",
-            "10.0.0.1",
-            ThreatLevel.MEDIUM,
-            IDEACategory.RECON_SCANNING,
-            "10.0.0.2",
-            2,
-            ["flow3", "flow4", "flow5"],
-            "2023/10/27 11:11:11.000000+0000",
-            "10.0.0.3",
-            "udp",
-            53,
-            Tag.RECON,
-            "d243119b-2aae-4d7a-8ea1-e4f3c6e72f4a",
-            5,
-            0.5,
-        ),
-        (
-            # Testcase3 :evidence_with_max_values
-            EvidenceType.MALICIOUS_JA3,
-            "Malicious JA3 fingerprint detected",
-            "172.16.0.1",
-            ThreatLevel.CRITICAL,
-            IDEACategory.INTRUSION_BOTNET,
-            "172.16.0.2",
-            100,
-            ["flow6", "flow7", "flow8", "flow9", "flow10"],
-            "2023/10/28 12:12:12.000000+0000",
-            "172.16.0.3",
-            "icmp",
-            0,
-            Tag.MALWARE,
-            "d243119b-2aae-4d7a-8ea1-eef3c6e72f4a",
-            1000,
-            1.0,
-        ),
-    ],
+    "evidence", EVIDENCE_SPECS, ids=EVIDENCE_IDS, indirect=True
 )
-def test_evidence_to_dict(
-    evidence_type,
-    description,
-    attacker_value,
-    threat_level,
-    category,
-    profile_ip,
-    timewindow_number,
-    uid,
-    timestamp,
-    victim_value,
-    proto_value,
-    port,
-    source_target_tag,
-    id,
-    conn_count,
-    confidence,
-):
-    attacker = ModuleFactory().create_attacker_obj(
-        value=attacker_value, direction=Direction.SRC, attacker_type=IoCType.IP
-    )
-    victim = ModuleFactory().create_victim_obj(
-        direction=Direction.DST, victim_type=IoCType.IP, value=victim_value
-    )
-    profile = ModuleFactory().create_profileid_obj(ip=profile_ip)
-    timewindow = ModuleFactory().create_timewindow_obj(
-        number=timewindow_number
-    )
-    proto = (ModuleFactory().create_proto_obj())[proto_value.upper()]
-
-    evidence = Evidence(
-        evidence_type=evidence_type,
-        description=description,
-        attacker=attacker,
-        threat_level=threat_level,
-        category=category,
-        victim=victim,
-        profile=profile,
-        timewindow=timewindow,
-        uid=uid,
-        timestamp=timestamp,
-        proto=proto,
-        port=port,
-        source_target_tag=source_target_tag,
-        id=id,
-        conn_count=conn_count,
-        confidence=confidence,
-    )
-
+def test_evidence_to_dict(evidence):
+    spec, evidence = evidence
     evidence_dict = evidence_to_dict(evidence)
 
     assert isinstance(evidence_dict, dict)
-    assert evidence_dict["evidence_type"] == evidence_type.name
-    assert evidence_dict["description"] == description
+    assert evidence_dict["evidence_type"] == spec.evidence_type.name
+    assert evidence_dict["description"] == spec.description
     assert evidence_dict["attacker"]["direction"] == Direction.SRC.name
     assert evidence_dict["attacker"]["attacker_type"] == IoCType.IP.name
-    assert evidence_dict["attacker"]["value"] == attacker_value
-    assert evidence_dict["threat_level"] == threat_level.name
-    assert evidence_dict["category"] == category.name
+    assert evidence_dict["attacker"]["value"] == spec.attacker_value
+    assert evidence_dict["threat_level"] == spec.threat_level.name
+    assert evidence_dict["category"] == spec.category.name
     assert evidence_dict["victim"]["direction"] == Direction.DST.name
     assert evidence_dict["victim"]["victim_type"] == IoCType.IP.name
-    assert evidence_dict["victim"]["value"] == victim_value
-    assert evidence_dict["profile"]["ip"] == profile_ip
-    assert evidence_dict["timewindow"]["number"] == timewindow_number
-    assert set(evidence_dict["uid"]) == set(uid)
-    assert evidence_dict["timestamp"] == timestamp
-    assert evidence_dict["proto"] == proto.name
-    assert evidence_dict["port"] == port
-    assert evidence_dict["source_target_tag"] == source_target_tag.name
-    assert evidence_dict["id"] == id
-    assert evidence_dict["conn_count"] == conn_count
-    assert evidence_dict["confidence"] == confidence
+    assert evidence_dict["victim"]["value"] == spec.victim_value
+    assert evidence_dict["profile"]["ip"] == spec.profile_ip
+    assert evidence_dict["timewindow"]["number"] == spec.timewindow_number
+    assert evidence_dict["uid"] == spec.uid
+    assert evidence_dict["timestamp"] == spec.timestamp
+    assert evidence_dict["proto"] == Proto[spec.proto_value.upper()].name
+    assert evidence_dict["port"] == spec.port
+    assert evidence_dict["source_target_tag"] == spec.source_target_tag.name
+    assert evidence_dict["id"] == spec.id
+    assert evidence_dict["conn_count"] == spec.conn_count
+    assert evidence_dict["confidence"] == spec.confidence
+
+
+def test_evidence_to_dict_nested_fields(factory):
+    evidence = factory.create_evidence_obj(
+        EvidenceType.ARP_SCAN,
+        "ARP scan detected",
+        Attacker(Direction.SRC, IoCType.IP, "192.168.1.1"),
+        ThreatLevel.LOW,
+        IDEACategory.ANOMALY_TRAFFIC,
+        False,
+        ProfileID(ip="192.168.1.1"),
+        TimeWindow(number=1),
+        ["flow1"],
+        "2023/10/26 10:10:10.000000+0000",
+        False,
+        None,
+        False,
+        "d4afbe1a-1cb9-4db4-9fac-74f2da6f5f34",
+        1,
+        0.8,
+    )
+
+    evidence_dict = evidence_to_dict(evidence)
+
+    assert evidence_dict["attacker"]["profile"] == {"ip": "192.168.1.1"}
+    assert evidence_dict["victim"] is False
+    assert evidence_dict["proto"] is False
+    assert evidence_dict["port"] is None
+    # the dict shouldn't share mutable values with the evidence
+    assert evidence_dict["uid"] == evidence.uid
+    assert evidence_dict["uid"] is not evidence.uid
 
 
 def test_validate_timestamp():
@@ -316,6 +283,12 @@ def test_validate_timestamp():
         "2023/10/32 10:10:10.000000+0000",
         # Testcase5: Completely invalid
         "not a timestamp",
+        # Testcase6: Invalid day of the month
+        "2023/02/30 10:10:10.000000+0000",
+        # Testcase7: Missing timezone
+        "2023/10/26 10:10:10.000000",
+        # Testcase8: Unix timestamp
+        "1698315010.0",
     ],
 )
 def test_validate_timestamp_invalid(timestamp):
@@ -323,14 +296,24 @@ def test_validate_timestamp_invalid(timestamp):
         validate_timestamp(timestamp)
 
 
-def test_profile_id_setattr():
-    profile = ProfileID(ip="192.168.1.1")
-    assert profile.ip == "192.168.1.1"
+@pytest.mark.parametrize(
+    "cls, kwargs, expected_repr",
+    [
+        (ProfileID, {"ip": "192.168.1.1"}, "profile_192.168.1.1"),
+        (TimeWindow, {"number": 5}, "timewindow5"),
+    ],
+    ids=["profile_id", "timewindow"],
+)
+def test_profile_id_and_timewindow(cls, kwargs, expected_repr):
+    obj = cls(**kwargs)
+    for attr, value in kwargs.items():
+        assert getattr(obj, attr) == value
+    assert repr(obj) == expected_repr
 
 
-def test_profile_id_repr():
-    profile = ProfileID(ip="192.168.1.1")
-    assert repr(profile) == "profile_192.168.1.1"
+def test_profile_id_setattr_invalid_ip():
+    with pytest.raises(ValueError):
+        ProfileID(ip="not an ip")
 
 
 def test_attacker_post_init():
@@ -338,16 +321,6 @@ def test_attacker_post_init():
     assert attacker.profile.ip == "192.168.1.1"
 
 
-def test_timewindow_post_init():
-    timewindow = TimeWindow(number=1)
-    assert timewindow.number == 1
-
-
-def test_timewindow_repr():
-    timewindow = TimeWindow(number=5)
-    assert repr(timewindow) == "timewindow5"
-
-
 @pytest.mark.parametrize(
     "threat_level, expected_value, expected_str",
     [
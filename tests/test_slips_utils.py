@@ -677,3 +677,25 @@ def test_to_json_serializable(input_obj, expected_json):
     utils = ModuleFactory().create_utils_obj()
     result = utils.to_json_serializable(input_obj)
     assert json.dumps(result) == expected_json
+
+
+def test_parse_new_flow_msg():
+    utils = ModuleFactory().create_utils_obj()
+    flow = {"daddr": "192.168.1.2", "dport": 443}
+    data = json.dumps(
+        {
+            "profileid": "profile_192.168.1.1",
+            "twid": "timewindow1",
+            "flow": json.dumps({"uid1": json.dumps(flow)}),
+            "stime": 1635765895.037696,
+        }
+    )
+    new_flow, uid, flow_dict = utils.parse_new_flow_msg(data)
+    assert new_flow["profileid"] == "profile_192.168.1.1"
+    assert uid == "uid1"
+    assert flow_dict == flow
+
+    # the same msg shouldn't be decoded again
+    with patch("json.loads") as mock_loads:
+        assert utils.parse_new_flow_msg(data)[2] is flow_dict
+    mock_loads.assert_not_called()
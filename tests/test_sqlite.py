@@ -0,0 +1,36 @@
+import json
+import pytest
+
+from tests.module_factory import ModuleFactory
+
+
+def add_altflow(sqlite, uid: str, flow: dict):
+    sqlite.execute(
+        "INSERT INTO altflows (uid, flow) VALUES (?, ?);",
+        (uid, json.dumps(flow)),
+    )
+
+
+@pytest.mark.parametrize(
+    "uids, expected_altflows",
+    [
+        # Testcase1: no uids, no query
+        ([], {}),
+        # Testcase2: one uid
+        (["uid1"], {"uid1": {"type_": "dns"}}),
+        # Testcase3: many uids, some of them without an altflow
+        (
+            ["uid1", "uid2", "uid3", "uid4"],
+            {"uid1": {"type_": "dns"}, "uid3": {"type_": "ssl"}},
+        ),
+        # Testcase4: none of the uids have an altflow
+        (["uid2", "uid4"], {}),
+    ],
+)
+def test_get_altflows_from_uids(tmp_path, uids, expected_altflows):
+    sqlite = ModuleFactory().create_sqlite_db_obj(str(tmp_path))
+    add_altflow(sqlite, "uid1", {"type_": "dns"})
+    add_altflow(sqlite, "uid3", {"type_": "ssl"})
+
+    assert sqlite.get_altflows_from_uids(uids) == expected_altflows
+    sqlite.close()
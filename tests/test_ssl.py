@@ -407,7 +407,9 @@ def test_check_non_ssl_port_443_conns(mocker, test_input, expected_call_count):
         "modules.flowalerts.set_evidence."
         "SetEvidnceHelper.non_ssl_port_443_conn"
     )
-    ssl.check_non_ssl_port_443_conns(test_input)
+    flow = json.loads(test_input["flow"])
+    uid = next(iter(flow))
+    ssl.check_non_ssl_port_443_conns(test_input, uid, json.loads(flow[uid]))
     assert mock_set_evidence.call_count == expected_call_count
 
 
@@ -0,0 +1,199 @@
+from tests.module_factory import ModuleFactory
+from modules.timeline.timeline import (
+    ALTFLOW_WAIT_TIME,
+    MAX_IDLE_WAIT_TIME,
+)
+from unittest.mock import Mock, patch
+from collections import deque
+import json
+import time
+import pytest
+
+profileid = "profile_192.168.1.1"
+twid = "timewindow1"
+timestamp = 1601998398.945854
+
+
+def test_add_timeline_lines_batches_flows():
+    timeline = ModuleFactory().create_timeline_object()
+    timeline.db.get_altflows_from_uids.return_value = {
+        "uid1": {"type_": "dns"},
+        "uid2": {"type_": "ssl"},
+    }
+    timeline.process_altflow = Mock(
+        side_effect=[{"info": "dns"}, {"info": "ssl"}]
+    )
+    flows = [
+        (profileid, twid, "uid1", {"dport_name": "DNS"}, timestamp),
+        (profileid, twid, "uid2", {"dport_name": "HTTPS"}, timestamp),
+    ]
+
+    timeline.add_timeline_lines(flows)
+
+    # one query for the altflows and one write for all the lines
+    timeline.db.get_altflows_from_uids.assert_called_once_with(
+        ["uid1", "uid2"]
+    )
+    timeline.db.add_timeline_lines.assert_called_once_with(
+        [
+            (
+                profileid,
+                twid,
+                {"dport_name": "DNS", "info": "dns"},
+                timestamp,
+            ),
+            (
+                profileid,
+                twid,
+                {"dport_name": "HTTPS", "info": "ssl"},
+                timestamp,
+            ),
+        ]
+    )
+    assert not timeline.pending_altflows
+
+
+def test_add_timeline_lines_waits_for_missing_altflows():
+    timeline = ModuleFactory().create_timeline_object()
+    timeline.db.get_altflows_from_uids.return_value = {
+        "uid1": {"type_": "dns"},
+    }
+    timeline.process_altflow = Mock(return_value={"info": "dns"})
+    flows = [
+        (profileid, twid, "uid1", {}, timestamp),
+        (profileid, twid, "uid2", {}, timestamp),
+    ]
+
+    with patch("time.monotonic", return_value=100):
+        timeline.add_timeline_lines(flows)
+
+    timeline.db.add_timeline_lines.assert_called_once_with(
+        [(profileid, twid, {"info": "dns"}, timestamp)]
+    )
+    assert timeline.pending_altflows == deque(
+        [(100 + ALTFLOW_WAIT_TIME, profileid, twid, "uid2", {}, timestamp)]
+    )
+
+
+@pytest.mark.parametrize(
+    "now, altflows, expected_lines, expected_pending",
+    [
+        # Testcase1: the flow didn't wait long enough yet
+        (100, {}, None, 1),
+        # Testcase2: the altflow arrived while waiting
+        (
+            101,
+            {"uid1": {"type_": "dns"}},
+            [(profileid, twid, {"info": "dns"}, timestamp)],
+            0,
+        ),
+        # Testcase3: the altflow never arrived, the flow is added without it
+        (
+            101,
+            {},
+            [(profileid, twid, {"info": ""}, timestamp)],
+            0,
+        ),
+    ],
+)
+def test_process_pending_altflows(
+    now, altflows, expected_lines, expected_pending
+):
+    timeline = ModuleFactory().create_timeline_object()
+    timeline.pending_altflows.append(
+        (100.5, profileid, twid, "uid1", {}, timestamp)
+    )
+    timeline.db.get_altflows_from_uids.return_value = altflows
+    timeline.process_altflow = Mock(
+        side_effect=lambda altflow: (
+            {"info": "dns"} if altflow else {"info": ""}
+        )
+    )
+
+    with patch("time.monotonic", return_value=now):
+        timeline.process_pending_altflows()
+
+    if expected_lines is None:
+        timeline.db.add_timeline_lines.assert_not_called()
+    else:
+        timeline.db.get_altflows_from_uids.assert_called_once_with(["uid1"])
+        timeline.db.add_timeline_lines.assert_called_once_with(expected_lines)
+    assert len(timeline.pending_altflows) == expected_pending
+
+
+@pytest.mark.parametrize(
+    "deadlines, now, expected_wait_time",
+    [
+        # Testcase1: no flows waiting for their altflows
+        ([], 100, MAX_IDLE_WAIT_TIME),
+        # Testcase2: the first flow should be processed soon
+        ([100.1, 100.3], 100, 0.1),
+        # Testcase3: the first flow is already due
+        ([99], 100, 0),
+        # Testcase4: the first flow is due after the max wait time
+        ([200], 100, MAX_IDLE_WAIT_TIME),
+    ],
+)
+def test_get_idle_wait_time(deadlines, now, expected_wait_time):
+    timeline = ModuleFactory().create_timeline_object()
+    for deadline in deadlines:
+        timeline.pending_altflows.append(
+            (deadline, profileid, twid, "uid", {}, timestamp)
+        )
+
+    with patch("time.monotonic", return_value=now):
+        assert timeline.get_idle_wait_time() == pytest.approx(
+            expected_wait_time
+        )
+
+
+def test_shutdown_gracefully_flushes_pending_altflows():
+    timeline = ModuleFactory().create_timeline_object()
+    # still far from its deadline
+    timeline.pending_altflows.append(
+        (time.monotonic() + 60, profileid, twid, "uid1", {}, timestamp)
+    )
+    timeline.db.get_altflows_from_uids.return_value = {}
+
+    timeline.shutdown_gracefully()
+
+    timeline.db.add_timeline_lines.assert_called_once_with(
+        [(profileid, twid, {"info": ""}, timestamp)]
+    )
+    assert not timeline.pending_altflows
+
+
+def test_main_keeps_the_order_of_the_flows():
+    timeline = ModuleFactory().create_timeline_object()
+    msgs = [
+        {
+            "data": json.dumps(
+                {
+                    "profileid": profileid,
+                    "twid": twid,
+                    "stime": timestamp + i,
+                    "flow": json.dumps({f"uid{i}": json.dumps({"n": i})}),
+                }
+            )
+        }
+        for i in range(8)
+    ]
+    timeline.get_msg = Mock(side_effect=msgs + [None])
+
+    def process_flow(profileid, flow):
+        # the first flows take the longest, so they finish last
+        time.sleep((8 - flow["n"]) * 0.005)
+        return {"n": flow["n"]}
+
+    timeline.process_flow = process_flow
+    timeline.add_timeline_lines = Mock()
+
+    timeline.main()
+    timeline.shutdown_gracefully()
+
+    timeline.add_timeline_lines.assert_called_once_with(
+        [
+            (profileid, twid, f"uid{i}", {"n": i}, timestamp + i)
+            for i in range(8)
+        ]
+    )